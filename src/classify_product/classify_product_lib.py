@@ -14,20 +14,32 @@
 
 """Provides image classification using Gemini."""
 
+import asyncio
+import collections
+import concurrent.futures
 import dataclasses
 import datetime
+import functools
 import hashlib
 import io
-import json
 import logging
-from typing import Optional
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Optional
 
+from config.structured_output import ImageType
 from config.structured_output import LabeledImage
 from google import genai
 from google.cloud import bigquery
+from google.genai import errors as genai_errors
 from google.genai import types
+import orjson
 from PIL import Image
 import requests
+from requests import adapters
+from urllib3.util import retry
 from shared.common import Product
 
 
@@ -60,18 +72,30 @@ class ProcessedImage:
   """Processed image data class."""
 
   image_link: str
-  genai_file_reference: types.File
+  # Inline image Part, or an uploaded File for images too large to inline.
+  genai_file_reference: Optional[types.Part | types.File]
   mime_type: str
   width: int
   height: int
   sha256_hash: str
   labeled_image: Optional[LabeledImage] = None
 
+  def image_attributes(self) -> dict[str, Any]:
+    """Returns the locally extracted image attributes as a dictionary."""
+    # Built directly, dataclasses.asdict would deep copy every field.
+    return {
+        'image_link': self.image_link,
+        'mime_type': self.mime_type,
+        'width': self.width,
+        'height': self.height,
+        'sha256_hash': self.sha256_hash,
+    }
+
   def to_json(self) -> str:
     """Returns a JSON string representation of the ProcessedImage."""
-    data_dict = dataclasses.asdict(self)
-    data_dict.pop('genai_file_reference', None)
-    return json.dumps(data_dict)
+    data_dict = self.image_attributes()
+    data_dict['labeled_image'] = self.labeled_image
+    return orjson.dumps(data_dict).decode('utf-8')
 
 
 USER_AGENT = (  # Default requests user agent can cause 403 errors.
@@ -80,110 +104,638 @@ USER_AGENT = (  # Default requests user agent can cause 403 errors.
 )
 # httpx (found in google.genai) has noisy logs, raise threshold to WARNING.
 logging.getLogger('httpx').setLevel(logging.WARNING)
+# Shared by all classifiers, so the config & schema are only validated once.
+GENAI_CONFIG = types.GenerateContentConfig(
+    response_mime_type='application/json',
+    response_schema=list[LabeledImage],
+    automatic_function_calling=types.AutomaticFunctionCallingConfig(
+        disable=True
+    ),
+    top_k=1,
+    top_p=0.2,
+)
+# Image downloads & Gemini calls are network-bound, so they are run on a
+# thread pool sized well above the CPU count to keep many requests in flight.
+MAX_IO_WORKERS = 32
+# Keep a pooled keep-alive connection per I/O worker across image hosts, and
+# retry transient download failures with backoff.
+HTTP_POOL_CONNECTIONS = 32
+HTTP_POOL_MAXSIZE = MAX_IO_WORKERS
+HTTP_RETRY = retry.Retry(
+    total=3,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+)
+# Defaults for batch processing, based on the Gemini API default quotas.
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_TOKENS_PER_MINUTE = 100_000
+RATE_LIMIT_MAX_RETRIES = 5
+RATE_LIMIT_BASE_DELAY_SECONDS = 1.0
+# Images are streamed & hashed in chunks rather than materialized at once.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Images up to this size are sent inline with the Gemini request, larger ones
+# are uploaded via the Files API.
+INLINE_IMAGE_MAX_BYTES = 1536 * 1024
+# Gemini requests are limited to 20 MB, in which inline images are base64
+# encoded & so take up 4/3 of their size. Once a product's encoded inline images
+# exceed this budget, which leaves room for the prompt, the remaining images are
+# uploaded via the Files API instead.
+INLINE_REQUEST_MAX_BYTES = 19 * 1000 * 1000
+# Number of image classifications kept in memory, keyed by image hash.
+LABEL_CACHE_SIZE = 10_000
+# Result rows are buffered & streamed to BigQuery in batches, flushed when
+# either limit is reached.
+BIGQUERY_BATCH_MAX_ROWS = 500
+BIGQUERY_BATCH_MAX_LATENCY_SECONDS = 2.0
+# Maximum difference in pixels between the width & height of a swatch image.
+SWATCH_MAX_ASPECT_DIFFERENCE = 10
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+  """Returns True if the error (or its cause) is a Gemini HTTP 429."""
+  cause = error.__cause__ or error
+  return isinstance(cause, genai_errors.APIError) and cause.code == 429
+
+
+def _log_failed_delete(image_link: str, future: concurrent.futures.Future):
+  """Logs a failed background delete of an uploaded file."""
+  if future.exception() is not None:
+    logging.warning(
+        'Failed to delete uploaded file for image %s',
+        image_link,
+        exc_info=future.exception(),
+    )
+
+
+# Clients are created lazily & shared by all ProductClassifier instances in the
+# process, so the connection pools and credentials are only set up once.
+_shared_clients: dict[str, Any] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def _get_shared_client(name: str, factory: Callable[[], Any]) -> Any:
+  """Returns the shared client with the given name, creating it if needed."""
+  with _shared_clients_lock:
+    if name not in _shared_clients:
+      _shared_clients[name] = factory()
+    return _shared_clients[name]
+
+
+def _reset_shared_clients() -> None:
+  """Drops the shared clients, as they are not safe to reuse after a fork."""
+  global _shared_clients_lock
+  _shared_clients_lock = threading.Lock()
+  _shared_clients.clear()
+
+
+os.register_at_fork(after_in_child=_reset_shared_clients)
+
+
+def _create_http_session() -> requests.Session:
+  """Creates an HTTP session with pooled connections & download retries."""
+  http_session = requests.Session()
+  http_adapter = adapters.HTTPAdapter(
+      pool_connections=HTTP_POOL_CONNECTIONS,
+      pool_maxsize=HTTP_POOL_MAXSIZE,
+      max_retries=HTTP_RETRY,
+  )
+  http_session.mount('http://', http_adapter)
+  http_session.mount('https://', http_adapter)
+  return http_session
+
+
+def get_http_session() -> requests.Session:
+  """Returns the HTTP session shared within the process."""
+  return _get_shared_client('http_session', _create_http_session)
+
+
+def get_bigquery_client() -> bigquery.Client:
+  """Returns the BigQuery client shared within the process."""
+  return _get_shared_client('bigquery_client', bigquery.Client)
+
+
+def get_genai_client() -> genai.Client:
+  """Returns the Gemini client shared within the process."""
+  return _get_shared_client('genai_client', genai.Client)
+
+
+class LabelCache:
+  """Thread-safe LRU cache of LabeledImage values keyed by image hash."""
+
+  def __init__(self, max_size: int = LABEL_CACHE_SIZE):
+    """Initializes the LabelCache.
+
+    Args:
+      max_size: the maximum number of entries to keep
+    """
+    self.max_size = max_size
+    self._entries: collections.OrderedDict[str, LabeledImage] = (
+        collections.OrderedDict()
+    )
+    self._lock = threading.Lock()
+
+  def get(self, sha256_hash: str) -> Optional[LabeledImage]:
+    """Returns the cached LabeledImage for the hash, or None on a miss."""
+    with self._lock:
+      labeled_image = self._entries.get(sha256_hash)
+      if labeled_image is not None:
+        self._entries.move_to_end(sha256_hash)
+      return labeled_image
+
+  def put(self, sha256_hash: str, labeled_image: LabeledImage) -> None:
+    """Caches the LabeledImage for the hash, evicting the oldest if full."""
+    with self._lock:
+      self._entries[sha256_hash] = labeled_image
+      self._entries.move_to_end(sha256_hash)
+      if len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+
+class BigQueryBatcher:
+  """Thread-safe buffer that writes rows to BigQuery in batches.
+
+  Rows are flushed once max_rows are buffered or the oldest buffered row is
+  older than max_latency_seconds (checked when rows are added), or when flush
+  is called. Every row is sent with an insert ID, so BigQuery deduplicates rows
+  that are re-sent after a failed flush.
+
+  The buffer is shared by concurrent requests, so add returns a future for the
+  caller's rows. Passing it to flush only raises errors for those rows.
+  """
+
+  def __init__(
+      self,
+      bigquery_client: bigquery.Client,
+      table_id: str,
+      max_rows: int = BIGQUERY_BATCH_MAX_ROWS,
+      max_latency_seconds: float = BIGQUERY_BATCH_MAX_LATENCY_SECONDS,
+  ):
+    """Initializes the BigQueryBatcher.
+
+    Args:
+      bigquery_client: the BigQuery client to write with
+      table_id: the BigQuery table to write rows to
+      max_rows: the number of buffered rows that triggers a flush
+      max_latency_seconds: the age of the oldest row that triggers a flush
+    """
+    self.bigquery_client = bigquery_client
+    self.table_id = table_id
+    self.max_rows = max_rows
+    self.max_latency_seconds = max_latency_seconds
+
+    self._rows: list[dict[str, Any]] = []
+    # The future & number of rows of each add call, in buffer order.
+    self._pending: list[tuple[concurrent.futures.Future, int]] = []
+    self._oldest_row_time: Optional[float] = None
+    # Held while writing, so flush returns only once earlier rows are written.
+    self._lock = threading.RLock()
+
+  def add(self, rows: list[dict[str, Any]]) -> concurrent.futures.Future:
+    """Buffers rows, writing the buffer if the batch is full or too old.
+
+    A failed write triggered here keeps the rows buffered for the next flush.
+
+    Args:
+      rows: the rows to write, each must have image_link & timestamp keys
+
+    Returns:
+      a future resolved once the rows are written, or set to a
+      BigQueryWriteError if any of them are rejected, see flush
+    """
+    future = concurrent.futures.Future()
+    if not rows:
+      future.set_result(None)
+      return future
+    with self._lock:
+      if not self._rows:
+        self._oldest_row_time = time.monotonic()
+      self._rows.extend(rows)
+      self._pending.append((future, len(rows)))
+      if (
+          len(self._rows) >= self.max_rows
+          or time.monotonic() - self._oldest_row_time
+          >= self.max_latency_seconds
+      ):
+        try:
+          self._write()
+        except BigQueryWriteError as e:
+          logging.warning('BigQuery write failed, rows kept for retry: %s', e)
+    return future
+
+  def flush(
+      self, pending_rows: Optional[list[concurrent.futures.Future]] = None
+  ) -> None:
+    """Writes all buffered rows to BigQuery.
+
+    Rows are kept in the buffer if the request fails, so they are retried by
+    the next flush. Rows rejected by BigQuery are not retried.
+
+    Args:
+      pending_rows: the futures returned by add for the caller's rows. If set,
+        only errors for those rows are raised. When the request fails, the
+        caller's rows are dropped from the buffer instead of being kept, so
+        they are not written again once the caller retries. If None, errors
+        for any row are raised.
+
+    Raises:
+      BigQueryWriteError: if the BigQuery write fails or rejects any of the
+        caller's rows
+    """
+    with self._lock:
+      if pending_rows is None:
+        errors = self._write()
+        if errors:
+          raise BigQueryWriteError(errors)
+      elif not all(future.done() for future in pending_rows):
+        try:
+          self._write()
+        except BigQueryWriteError as e:
+          self._discard(pending_rows, e)
+    for future in pending_rows or []:
+      # Every future is resolved by now, as the buffer was written.
+      future.result(timeout=0)
+
+  def _write(self) -> list[dict[str, Any]]:
+    """Writes all buffered rows, resolving the futures of their add calls.
+
+    Returns:
+      the errors of the rows rejected by BigQuery
+
+    Raises:
+      BigQueryWriteError: if the BigQuery write fails
+    """
+    if not self._rows:
+      return []
+    rows = self._rows
+    row_ids = [
+        hashlib.sha256(
+            f'{row["image_link"]}|{row["timestamp"]}'.encode('utf-8')
+        ).hexdigest()
+        for row in rows
+    ]
+    try:
+      errors = self.bigquery_client.insert_rows_json(
+          self.table_id, rows, row_ids=row_ids
+      )
+    except Exception as e:
+      raise BigQueryWriteError(e) from e
+    pending = self._pending
+    self._rows = []
+    self._pending = []
+    self._oldest_row_time = None
+
+    first_row_index = 0
+    for future, row_count in pending:
+      row_indexes = range(first_row_index, first_row_index + row_count)
+      first_row_index += row_count
+      row_errors = [e for e in errors if e['index'] in row_indexes]
+      if row_errors:
+        future.set_exception(BigQueryWriteError(row_errors))
+      else:
+        future.set_result(None)
+    return errors
+
+  def _discard(
+      self,
+      pending_rows: list[concurrent.futures.Future],
+      error: BigQueryWriteError,
+  ) -> None:
+    """Drops the rows of the given add calls from the buffer, failing them."""
+    rows = []
+    pending = []
+    first_row_index = 0
+    for future, row_count in self._pending:
+      if future in pending_rows:
+        future.set_exception(error)
+      else:
+        rows.extend(self._rows[first_row_index : first_row_index + row_count])
+        pending.append((future, row_count))
+      first_row_index += row_count
+    self._rows = rows
+    self._pending = pending
+    if not rows:
+      self._oldest_row_time = None
+
+
+class AdaptiveRateLimiter:
+  """Limits in-flight Gemini requests using AIMD & per-minute budgets.
+
+  The concurrency limit grows by one after each successful request and is
+  halved after a rate-limit (HTTP 429) response, bounded by max_concurrency.
+  Requests & tokens are also tracked over a sliding one minute window.
+
+  The limiter uses asyncio primitives, so an instance must only be used from a
+  single event loop.
+  """
+
+  def __init__(
+      self,
+      max_concurrency: int,
+      requests_per_minute: Optional[int] = None,
+      tokens_per_minute: Optional[int] = None,
+  ):
+    """Initializes the AdaptiveRateLimiter.
+
+    Args:
+      max_concurrency: the upper bound for concurrent requests
+      requests_per_minute: the request budget per minute, None for unlimited
+      tokens_per_minute: the token budget per minute, None for unlimited
+    """
+    self.max_concurrency = max_concurrency
+    self.requests_per_minute = requests_per_minute
+    self.tokens_per_minute = tokens_per_minute
+    self.concurrency_limit = float(max_concurrency)
+
+    self._in_flight = 0
+    self._request_times = collections.deque()
+    self._token_usage = collections.deque()
+    self._condition = asyncio.Condition()
+
+  def _expire(self, now: float) -> None:
+    """Drops requests & token usage older than the one minute window."""
+    while self._request_times and now - self._request_times[0] >= 60:
+      self._request_times.popleft()
+    while self._token_usage and now - self._token_usage[0][0] >= 60:
+      self._token_usage.popleft()
+
+  def _seconds_until_available(self, now: float) -> Optional[float]:
+    """Returns the wait for a slot, 0 if available, None if concurrency-bound."""
+    self._expire(now)
+    window_waits = []
+    if (
+        self.requests_per_minute is not None
+        and len(self._request_times) >= self.requests_per_minute
+    ):
+      window_waits.append(60 - (now - self._request_times[0]))
+    if self.tokens_per_minute is not None and self._token_usage:
+      if sum(t for _, t in self._token_usage) >= self.tokens_per_minute:
+        window_waits.append(60 - (now - self._token_usage[0][0]))
+    if window_waits:
+      return max(window_waits)
+    if self._in_flight >= int(self.concurrency_limit):
+      return None
+    return 0
+
+  async def acquire(self) -> None:
+    """Waits until a request can be sent without exceeding the limits."""
+    async with self._condition:
+      while True:
+        wait = self._seconds_until_available(time.monotonic())
+        if wait == 0:
+          break
+        try:
+          await asyncio.wait_for(self._condition.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+          pass
+      self._in_flight += 1
+      self._request_times.append(time.monotonic())
+
+  async def release(self, tokens: int = 0, rate_limited: bool = False) -> None:
+    """Releases a request slot & adjusts the concurrency limit.
+
+    Args:
+      tokens: the number of tokens consumed by the request
+      rate_limited: whether the request was rejected with HTTP 429
+    """
+    async with self._condition:
+      self._in_flight -= 1
+      if tokens:
+        self._token_usage.append((time.monotonic(), tokens))
+      if rate_limited:
+        self.concurrency_limit = max(1.0, self.concurrency_limit * 0.5)
+      else:
+        self.concurrency_limit = min(
+            float(self.max_concurrency), self.concurrency_limit + 1
+        )
+      self._condition.notify_all()
 
 
 class ProductClassifier:
   """Product classifier class."""
 
-  def __init__(self, prompt: str, model_name: str, table_id: str):
+  def __init__(
+      self,
+      prompt: str,
+      model_name: str,
+      table_id: str,
+      swatch_max_dimension: Optional[int] = None,
+      http_session: Optional[requests.Session] = None,
+      bigquery_client: Optional[bigquery.Client] = None,
+      genai_client: Optional[genai.Client] = None,
+  ):
     """Initializes the ProductClassifier.
 
     Args:
       prompt: the generative prompt to use
       model_name: the Gemini model to use
       table_id: the BigQuery table to write results to
+      swatch_max_dimension: if set, small square images up to this size are
+        labeled as swatches without querying Gemini
+      http_session: the HTTP session to pull images with, defaults to the
+        shared session
+      bigquery_client: the BigQuery client to use, defaults to the shared client
+      genai_client: the Gemini client to use, defaults to the shared client
     """
     self.prompt = prompt
     self.model_name = model_name
     self.table_id = table_id
+    self.swatch_max_dimension = swatch_max_dimension
 
-    self.http_session = requests.Session()
-    self.bigquery_client = bigquery.Client()
-    self.genai_client = genai.Client()
+    self.http_session = http_session or get_http_session()
+    self.bigquery_client = bigquery_client or get_bigquery_client()
+    self.genai_client = genai_client or get_genai_client()
 
     self.http_headers = {'User-Agent': USER_AGENT} if USER_AGENT else {}
-
-    self.genai_config = types.GenerateContentConfig(
-        response_mime_type='application/json',
-        response_schema=list[LabeledImage],
-        automatic_function_calling=types.AutomaticFunctionCallingConfig(
-            disable=True
-        ),
-        top_k=1,
-        top_p=0.2,
+    self.io_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=MAX_IO_WORKERS
     )
+    self.label_cache = LabelCache()
+    self.bigquery_batcher = BigQueryBatcher(self.bigquery_client, table_id)
+
+    self.genai_config = GENAI_CONFIG
 
   def process_image(self, image_link: str) -> ProcessedImage:
-    """Processes an image link to extract relevant details & upload to Gemini.
+    """Processes an image link to extract relevant details & prepare for Gemini.
+
+    Images are attached inline to the Gemini request, unless larger than
+    INLINE_IMAGE_MAX_BYTES in which case they are uploaded via the Files API
+    (see also upload_images_over_inline_budget).
+    Images whose hash is found in the label cache are returned with the cached
+    LabeledImage value instead.
 
     Args:
       image_link: the image link to process
 
     Returns:
-      a populated ProcessedImage dataclass (except for LabeledImage value)
+      a populated ProcessedImage dataclass (LabeledImage only if cached)
 
     Raises:
       ImagePullError: if the image cannot be downloaded from the link
       GenerativeAIError: if the image cannot be uploaded to Gemini
     """
-    # Download image from link
+    # Download image from link, hashing it while it is streamed into a buffer.
+    image_file = io.BytesIO()
+    sha256 = hashlib.sha256()
     try:
-      response = self.http_session.get(image_link, headers=self.http_headers)
-      response.raise_for_status()
-      response_content = response.content
-      mime_type = response.headers.get('content-type')
+      with self.http_session.get(
+          image_link, headers=self.http_headers, stream=True
+      ) as response:
+        response.raise_for_status()
+        mime_type = response.headers.get('content-type')
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+          sha256.update(chunk)
+          image_file.write(chunk)
     except Exception as e:
       raise ImagePullError(e) from e
 
-    # Upload image to Gemini for multimodal query.
-    image_file = io.BytesIO(response_content)
-    try:
-      genai_file_reference = self.genai_client.files.upload(
-          file=image_file, config={'mime_type': mime_type}
-      )
-    except Exception as e:
-      raise GenerativeAIError(e) from e
-
     # Process image attributes locally
-    sha256_hash = hashlib.sha256(response_content).hexdigest()
-    image_obj = Image.open(image_file)
-    width, height = image_obj.size
-    # Release memory by deleting image object.
-    del image_obj, image_file
+    image_size = image_file.tell()
+    sha256_hash = sha256.hexdigest()
+    image_file.seek(0)
+    # Image.open only parses the header, the pixel data is never decoded.
+    with Image.open(image_file) as image_obj:
+      width, height = image_obj.size
 
-    return ProcessedImage(
+    processed_image = ProcessedImage(
         image_link=image_link,
-        genai_file_reference=genai_file_reference,
+        genai_file_reference=None,
         mime_type=mime_type,
         width=width,
         height=height,
         sha256_hash=sha256_hash,
+        labeled_image=self.label_cache.get(sha256_hash),
+    )
+    if processed_image.labeled_image is not None:
+      return processed_image
+
+    if image_size <= INLINE_IMAGE_MAX_BYTES:
+      processed_image.genai_file_reference = types.Part.from_bytes(
+          data=image_file.getvalue(), mime_type=mime_type
+      )
+      return processed_image
+
+    # Upload large image to Gemini for multimodal query.
+    image_file.seek(0)
+    try:
+      processed_image.genai_file_reference = self.genai_client.files.upload(
+          file=image_file, config={'mime_type': mime_type}
+      )
+    except Exception as e:
+      raise GenerativeAIError(e) from e
+
+    return processed_image
+
+  def upload_images_over_inline_budget(
+      self, processed_images: list[ProcessedImage]
+  ) -> None:
+    """Uploads inline images via the Files API once the request is too large.
+
+    Only images still to be labeled count towards INLINE_REQUEST_MAX_BYTES, by
+    their base64 encoded size. Inline images beyond the budget are uploaded &
+    their reference replaced, see delete_uploaded_files.
+
+    Args:
+      processed_images: the ProcessedImage dataclasses of a single product
+
+    Raises:
+      GenerativeAIError: if an image cannot be uploaded to Gemini
+    """
+    inline_bytes = 0
+    for processed_image in self.get_images_to_label(processed_images):
+      part = processed_image.genai_file_reference
+      if not isinstance(part, types.Part):
+        continue
+      image_bytes = part.inline_data.data
+      # Base64 encodes every (started) 3 bytes as 4 characters.
+      encoded_size = (len(image_bytes) + 2) // 3 * 4
+      if inline_bytes + encoded_size <= INLINE_REQUEST_MAX_BYTES:
+        inline_bytes += encoded_size
+        continue
+      try:
+        processed_image.genai_file_reference = self.genai_client.files.upload(
+            file=io.BytesIO(image_bytes),
+            config={'mime_type': processed_image.mime_type},
+        )
+      except Exception as e:
+        raise GenerativeAIError(e) from e
+
+  def is_swatch(self, processed_image: ProcessedImage) -> bool:
+    """Returns True if the image dimensions match those of a swatch image.
+
+    Args:
+      processed_image: the ProcessedImage to check
+
+    Returns:
+      True if swatch detection is enabled and the image is small and square
+    """
+    if self.swatch_max_dimension is None:
+      return False
+    width, height = processed_image.width, processed_image.height
+    return (
+        max(width, height) <= self.swatch_max_dimension
+        and abs(width - height) < SWATCH_MAX_ASPECT_DIFFERENCE
     )
 
+  def get_images_to_label(
+      self, processed_images: list[ProcessedImage]
+  ) -> list[ProcessedImage]:
+    """Returns the distinct images that still need to be labeled by Gemini.
+
+    Swatch images are labeled here without querying Gemini (see is_swatch), and
+    images that are already labeled are skipped. Identical images (e.g. served
+    from mirrored links) are only returned once, run_multimodal_query copies
+    their label to the duplicates.
+
+    Args:
+      processed_images: a list of ProcessedImage dataclasses to classify
+
+    Returns:
+      the unlabeled ProcessedImage dataclasses, one per image hash
+    """
+    images_by_hash = {}
+    for processed_image in processed_images:
+      if processed_image.labeled_image is not None:
+        continue
+      if self.is_swatch(processed_image):
+        processed_image.labeled_image = LabeledImage(type=ImageType.SWATCH)
+        continue
+      images_by_hash.setdefault(processed_image.sha256_hash, processed_image)
+    return list(images_by_hash.values())
+
   def run_multimodal_query(
       self,
       product: Product,
       processed_images: list[ProcessedImage],
-  ) -> str:
+  ) -> Optional[types.GenerateContentResponse]:
     """Runs a multimodal query via Gemini to classify a set of images.
 
-    The LabeledImage class is written back to the ProcessedImage dataclass.
+    The LabeledImage class is written back to the ProcessedImage dataclass, and
+    added to the label cache. Images that are already labeled are skipped,
+    images with the same hash are only classified once, and swatch images are
+    labeled without querying Gemini (see is_swatch).
+    Uploaded images are not deleted here so the query can be retried, see
+    delete_uploaded_files.
 
     Args:
       product: the Product dataclass for the images to be processed
       processed_images: a list of ProcessedImage dataclasses to classify
 
     Returns:
-      the Gemini API response text
+      the Gemini API response, or None if all images were already labeled
 
     Raises:
       GenerativeAIError: if the Gemini query fails
     """
+    images_to_label = self.get_images_to_label(processed_images)
+    if not images_to_label:
+      return None
+
     prompt = []
 
     # Adding image indexes to the prompt to match the output with the images.
     # https://cloud.google.com/vertex-ai/generative-ai/docs/multimodal/image-understanding#best-practices
-    image_ids = ['image ' + str(i + 1) for i in range(len(processed_images))]
+    image_ids = ['image ' + str(i + 1) for i in range(len(images_to_label))]
     prompt.extend(image_ids)
     prompt.append(self.prompt)
     if product.title is not None:
@@ -194,9 +746,9 @@ class ProductClassifier:
           f' {product.product_type}'
       )
 
-    # Join the uploaded image references and prompt strings together.
+    # Join the image parts / uploaded references and prompt strings together.
     text_prompt = '\n'.join(prompt)
-    contents = [i.genai_file_reference for i in processed_images] + [
+    contents = [i.genai_file_reference for i in images_to_label] + [
         text_prompt
     ]
 
@@ -206,14 +758,27 @@ class ProductClassifier:
           model=self.model_name, contents=contents, config=self.genai_config
       )
       labeled_images: list[LabeledImage] = response.parsed
+      if labeled_images is None:
+        # The SDK could not validate the response against the schema, fall
+        # back to decoding the raw JSON text.
+        labeled_images = orjson.loads(response.text)
 
-      if len(labeled_images) != len(processed_images):
+      if len(labeled_images) != len(images_to_label):
         raise ValueError(
             'Gemini response length does not match number of images to be'
             ' classified.'
         )
+      labels_by_hash = {}
       for pos, labeled_image in enumerate(labeled_images):
-        processed_images[pos].labeled_image = labeled_image
+        images_to_label[pos].labeled_image = labeled_image
+        self.label_cache.put(images_to_label[pos].sha256_hash, labeled_image)
+        labels_by_hash[images_to_label[pos].sha256_hash] = labeled_image
+      # Duplicates of the labeled images are the only ones left unlabeled.
+      for processed_image in processed_images:
+        if processed_image.labeled_image is None:
+          processed_image.labeled_image = labels_by_hash[
+              processed_image.sha256_hash
+          ]
     except Exception as e:
       logging.warning(
           '[ERROR] Detected error when processing Gemini response for product'
@@ -229,61 +794,167 @@ class ProductClassifier:
           },
       )
       raise GenerativeAIError(e) from e
-    finally:
-      # Delete the uploaded images from Gemini after processing.
-      for processed_image in processed_images:
-        self.genai_client.files.delete(
-            name=processed_image.genai_file_reference.name
-        )
 
-    return response.text
+    return response
+
+  def delete_uploaded_files(
+      self, processed_images: list[ProcessedImage]
+  ) -> list[concurrent.futures.Future]:
+    """Deletes the uploaded images from Gemini in the background.
 
-  def write_result_to_bigquery(self, processed_images: list[ProcessedImage]):
-    """Writes results to BigQuery.
+    Deletes run concurrently on the I/O thread pool and are not waited on, as
+    uploaded files also expire automatically after 48 hours.
+
+    Args:
+      processed_images: a list of ProcessedImage dataclasses to clean up
+
+    Returns:
+      the futures of the scheduled deletes
+    """
+    futures = []
+    for processed_image in processed_images:
+      if not isinstance(processed_image.genai_file_reference, types.File):
+        continue
+      future = self.io_executor.submit(
+          self.genai_client.files.delete,
+          name=processed_image.genai_file_reference.name,
+      )
+      future.add_done_callback(
+          functools.partial(_log_failed_delete, processed_image.image_link)
+      )
+      futures.append(future)
+    return futures
+
+  def write_result_to_bigquery(
+      self, processed_images: list[ProcessedImage]
+  ) -> concurrent.futures.Future:
+    """Queues results to be written to BigQuery by the bigquery_batcher.
 
     Args:
       processed_images: a list of ProcessedImage dataclasses to write rows for.
 
-    Raises:
-      BigQueryWriteError: if the BigQuery write fails
+    Returns:
+      the future of the queued rows, to pass to bigquery_batcher.flush
     """
     rows = []
-    insertion_datetime = datetime.datetime.now(datetime.timezone.utc)
-    insertion_timestamp = insertion_datetime.strftime('%Y-%m-%d %H:%M:%S')
+    # Computed once for the batch, ISO 8601 is accepted by BigQuery as is.
+    insertion_timestamp = datetime.datetime.now(
+        datetime.timezone.utc
+    ).isoformat(sep=' ', timespec='seconds')
 
     for processed_image in processed_images:
-      row = {
-          key: value
-          for key, value in dataclasses.asdict(processed_image).items()
-          if key not in ('genai_file_reference', 'labeled_image')
-      }
+      row = processed_image.image_attributes()
       row.update(processed_image.labeled_image)
       row['timestamp'] = insertion_timestamp
       rows.append(row)
-    try:
-      errors = self.bigquery_client.insert_rows_json(self.table_id, rows)
-      if errors:
-        raise BigQueryWriteError(errors)
-    except Exception as e:
-      raise BigQueryWriteError(e) from e
+    return self.bigquery_batcher.add(rows)
 
-  def process_product(self, product: Product):
+  async def _run_io(self, func, *args):
+    """Runs a blocking I/O call on the shared thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        self.io_executor, functools.partial(func, *args)
+    )
+
+  async def _run_multimodal_query_with_backoff(
+      self,
+      product: Product,
+      processed_images: list[ProcessedImage],
+      rate_limiter: AdaptiveRateLimiter,
+  ) -> Optional[types.GenerateContentResponse]:
+    """Runs run_multimodal_query under the rate limiter, retrying on 429s.
+
+    The rate limiter is only acquired if some images still need to be labeled,
+    so products whose images are all cached or swatches use no Gemini quota.
+
+    Args:
+      product: the Product dataclass for the images to be processed
+      processed_images: a list of ProcessedImage dataclasses to classify
+      rate_limiter: the AdaptiveRateLimiter shared by the batch
+
+    Returns:
+      the Gemini API response, or None if all images were already labeled
+
+    Raises:
+      GenerativeAIError: if the Gemini query fails or retries are exhausted
+    """
+    if not self.get_images_to_label(processed_images):
+      return None
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+      await rate_limiter.acquire()
+      # Released exactly once, including on cancellation & unexpected errors.
+      tokens = 0
+      rate_limited = False
+      try:
+        response = await self._run_io(
+            self.run_multimodal_query, product, processed_images
+        )
+        usage_metadata = response.usage_metadata if response else None
+        if usage_metadata and usage_metadata.total_token_count:
+          tokens = usage_metadata.total_token_count
+      except GenerativeAIError as e:
+        rate_limited = _is_rate_limit_error(e)
+        if not rate_limited or attempt == RATE_LIMIT_MAX_RETRIES:
+          raise
+      finally:
+        await rate_limiter.release(tokens=tokens, rate_limited=rate_limited)
+      if not rate_limited:
+        return response
+      # Exponential backoff with full jitter.
+      await asyncio.sleep(
+          random.uniform(0, RATE_LIMIT_BASE_DELAY_SECONDS * 2**attempt)
+      )
+
+  async def process_product_async(
+      self,
+      product: Product,
+      rate_limiter: Optional[AdaptiveRateLimiter] = None,
+  ) -> concurrent.futures.Future:
     """Processes product to extract relevant details locally & using Gemini.
 
+    All images of the product are downloaded & prepared concurrently. Result
+    rows are queued on bigquery_batcher, which the caller must flush.
+
     Args:
       product: the Product dataclass to process
+      rate_limiter: an optional AdaptiveRateLimiter for the Gemini query
+
+    Returns:
+      the future of the queued rows, to pass to bigquery_batcher.flush
     """
+    processed_images = []
     try:
-      image_links = [
-          x
-          for x in [product.image_link] + product.additional_image_links
-          if x is not None
-      ]
-      processed_images = [
-          self.process_image(image_link) for image_link in image_links
-      ]
-      gemini_response = self.run_multimodal_query(product, processed_images)
-      self.write_result_to_bigquery(processed_images)
+      # Feeds often repeat the main image in the additional image links.
+      image_links = list(
+          dict.fromkeys(
+              x
+              for x in [product.image_link] + product.additional_image_links
+              if x is not None
+          )
+      )
+      results = await asyncio.gather(
+          *(self._run_io(self.process_image, link) for link in image_links),
+          return_exceptions=True,
+      )
+      processed_images = [r for r in results if isinstance(r, ProcessedImage)]
+      for result in results:
+        if isinstance(result, BaseException):
+          raise result
+      await self._run_io(
+          self.upload_images_over_inline_budget, processed_images
+      )
+
+      if rate_limiter:
+        gemini_response = await self._run_multimodal_query_with_backoff(
+            product, processed_images, rate_limiter
+        )
+      else:
+        gemini_response = await self._run_io(
+            self.run_multimodal_query, product, processed_images
+        )
+      pending_rows = await self._run_io(
+          self.write_result_to_bigquery, processed_images
+      )
     except Exception:
       logging.error(
           '[FAILED] Error processing product ID %s',
@@ -291,6 +962,8 @@ class ProductClassifier:
           extra={'json_fields': {'product': product.to_json()}},
       )
       raise
+    finally:
+      self.delete_uploaded_files(processed_images)
 
     logging.info(
         '[COMPLETED] Finished processing product ID %s',
@@ -299,7 +972,79 @@ class ProductClassifier:
             'json_fields': {
                 'product': product.to_json(),
                 'processed_images': [pi.to_json() for pi in processed_images],
-                'gemini_response': gemini_response,
+                'gemini_response': (
+                    gemini_response.text if gemini_response else None
+                ),
             }
         },
     )
+    return pending_rows
+
+  async def process_products_async(
+      self,
+      products: list[Product],
+      max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+      requests_per_minute: Optional[int] = DEFAULT_REQUESTS_PER_MINUTE,
+      tokens_per_minute: Optional[int] = DEFAULT_TOKENS_PER_MINUTE,
+  ):
+    """Processes a batch of products concurrently.
+
+    Every product is attempted even if some fail, and the BigQuery rows of the
+    batch are flushed before returning.
+
+    Args:
+      products: the Product dataclasses to process
+      max_concurrency: the maximum number of products processed at once
+      requests_per_minute: the Gemini request budget, None for unlimited
+      tokens_per_minute: the Gemini token budget, None for unlimited
+
+    Raises:
+      TooManyFailuresError: if any of the products failed to process
+      BigQueryWriteError: if the final BigQuery write fails
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    rate_limiter = AdaptiveRateLimiter(
+        max_concurrency, requests_per_minute, tokens_per_minute
+    )
+
+    async def process_one(product: Product) -> concurrent.futures.Future:
+      async with semaphore:
+        return await self.process_product_async(product, rate_limiter)
+
+    results = await asyncio.gather(
+        *(process_one(product) for product in products), return_exceptions=True
+    )
+    await self._run_io(
+        self.bigquery_batcher.flush,
+        [r for r in results if isinstance(r, concurrent.futures.Future)],
+    )
+    failed_offer_ids = [
+        product.offer_id
+        for product, result in zip(products, results)
+        if isinstance(result, Exception)
+    ]
+    if failed_offer_ids:
+      raise TooManyFailuresError(
+          f'{len(failed_offer_ids)} of {len(products)} products failed:'
+          f' {failed_offer_ids}'
+      )
+
+  def process_product(self, product: Product):
+    """Synchronous wrapper around process_product_async.
+
+    The BigQuery rows of the product are flushed before returning.
+
+    Args:
+      product: the Product dataclass to process
+    """
+    pending_rows = asyncio.run(self.process_product_async(product))
+    self.bigquery_batcher.flush([pending_rows])
+
+  def process_products(self, products: list[Product], **kwargs):
+    """Synchronous wrapper around process_products_async.
+
+    Args:
+      products: the Product dataclasses to process
+      **kwargs: keyword arguments passed to process_products_async
+    """
+    asyncio.run(self.process_products_async(products, **kwargs))
@@ -36,13 +36,15 @@ DATASET_ID = os.environ['DATASET_ID']
 TABLE_NAME = os.environ['TABLE_NAME']
 TABLE_ID = f'{PROJECT_ID}.{DATASET_ID}.{TABLE_NAME}'
 MODEL_NAME = os.environ['MODEL_NAME']
+# Optional, 0 or unset sends all images to Gemini.
+SWATCH_MAX_DIMENSION = int(os.environ.get('SWATCH_MAX_DIMENSION', 0)) or None
 
 _PROMPT_FILE = os.path.join('config', 'prompt.txt')
 with open(_PROMPT_FILE, 'r', encoding='utf-8') as f:
   PROMPT = f.read()
 
 product_classifier_cls = classify_product_lib.ProductClassifier(
-    PROMPT, MODEL_NAME, TABLE_ID
+    PROMPT, MODEL_NAME, TABLE_ID, SWATCH_MAX_DIMENSION
 )
 
 
@@ -59,10 +61,17 @@ def run(request) -> str:
     request_json = request.get_json(silent=True)
     if not request_json:
       return 'Bad Request: No JSON data provided', 400
-    product = classify_product_lib.Product(**request_json)
+    # Tasks carry either a single product or a batch of products.
+    if isinstance(request_json, list):
+      products = [classify_product_lib.Product(**p) for p in request_json]
+    else:
+      products = [classify_product_lib.Product(**request_json)]
   except (TypeError, ValueError) as e:
     return f'Bad Request: Invalid JSON format: {e}', 400
 
-  product_classifier_cls.process_product(product)
+  if len(products) == 1:
+    product_classifier_cls.process_product(products[0])
+  else:
+    product_classifier_cls.process_products(products)
 
   return 'OK', 200
@@ -14,6 +14,7 @@
 
 """Provides a Cloud Function to push new products to Cloud Tasks."""
 
+import itertools
 import logging
 import os
 
@@ -34,6 +35,23 @@ QUEUE_ID = os.environ.get('QUEUE_ID', 'Queue ID env variable is not set.')
 CLOUD_FUNCTION_URL = os.environ.get(
     'CLOUD_FUNCTION_URL', 'Cloud Function URL env variable is not set.'
 )
+# Number of products sent to the classify Cloud Function per task.
+TASK_BATCH_SIZE = int(os.environ.get('TASK_BATCH_SIZE', 1))
+if TASK_BATCH_SIZE < 1:
+  raise ValueError(
+      f'TASK_BATCH_SIZE must be at least 1, got {TASK_BATCH_SIZE}.'
+  )
+# Whether to include tracebacks when logging failed tasks.
+LOG_TRACEBACKS = os.environ.get('LOG_TRACEBACKS', '').lower() == 'true'
+
+# Reused across invocations, so the BigQuery & Cloud Tasks clients are only
+# created once per instance.
+product_pusher = push_products_lib.ProductPusher(
+    project_id=PROJECT_ID,
+    dataset_id=DATASET_ID,
+    location=LOCATION,
+    queue_id=QUEUE_ID,
+)
 
 
 @functions_framework.http
@@ -42,24 +60,29 @@ def run(request):
   request_json = request.get_json(silent=True)
   product_limit = request_json.get('product_limit', 10)
 
-  product_pusher = push_products_lib.ProductPusher(
-      project_id=PROJECT_ID,
-      dataset_id=DATASET_ID,
-      location=LOCATION,
-      queue_id=QUEUE_ID,
-  )
-  products = product_pusher.get_new_products_from_view(
+  # Products are streamed from BigQuery while tasks are created.
+  products = product_pusher.iter_new_products_from_view(
       product_limit=product_limit
   )
-  if products:
+  first_product = next(products, None)
+  if first_product is not None:
     # To prevent duplicate tasks, do not push unless queue is empty.
     if not product_pusher.is_queue_empty():
       raise push_products_lib.CloudTasksQueueNotEmptyError(
           'Queue is not empty!'
       )
-    logging.info('Found %d new products to push', len(products))
-    product_pusher.push_products(
-        products=products, cloud_function_url=CLOUD_FUNCTION_URL
+    success_count, failure_count = product_pusher.push_products(
+        products=itertools.chain([first_product], products),
+        cloud_function_url=CLOUD_FUNCTION_URL,
+        batch_size=TASK_BATCH_SIZE,
+        log_tracebacks=LOG_TRACEBACKS,
+    )
+    # Products are streamed, so they are only counted once all are pushed.
+    logging.info(
+        'Found %d new products to push, %d pushed & %d failed.',
+        success_count + failure_count,
+        success_count,
+        failure_count,
     )
   else:
     logging.info('No new products found, exiting...')
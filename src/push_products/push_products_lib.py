@@ -14,12 +14,28 @@
 
 """Library with functionality to push new products to Cloud Tasks."""
 
-import dataclasses
-import json
+import asyncio
+import concurrent.futures
+import itertools
 import logging
-from typing import List, Optional, Tuple
-
+import traceback
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+    TypeVar,
+)
+
+from google.api_core import exceptions as api_exceptions
+from google.api_core import retry_async
 from google.cloud import bigquery
+from google.cloud import bigquery_storage
 from google.cloud import tasks_v2
 
 try:
@@ -28,9 +44,49 @@ except ImportError:
   # This handles cases when code is not deployed using Terraform
   from ..shared import common  # pylint: disable=g-import-not-at-top, relative-beyond-top-level
 
+if TYPE_CHECKING:
+  import pyarrow  # pylint: disable=g-import-not-at-top
+
 Product = common.Product
 ProductFilter = common.ProductFilter
 
+# Maximum number of create task RPCs in flight at once.
+MAX_PUSH_CONCURRENCY = 64
+
+# Above this many rows, query results are downloaded as Arrow with the BigQuery
+# Storage Read API. Below it, the read session setup outweighs the faster
+# download, so rows are paged through the REST API.
+STORAGE_API_MIN_ROWS = 10_000
+# Task creation is retried with backoff when the service is unavailable, in
+# which case the task was not created. Other errors, including deadlines after
+# which the task may have been created, count as failures.
+CREATE_TASK_RETRY = retry_async.AsyncRetry(
+    predicate=retry_async.if_exception_type(api_exceptions.ServiceUnavailable),
+    initial=0.1,
+    maximum=2.0,
+    multiplier=2.0,
+    timeout=10.0,
+)
+
+# Query selecting the Product fields from a products view. Filter values and
+# the limit are passed as query parameters.
+PRODUCTS_QUERY_TEMPLATE = (
+    'SELECT'
+    '   offer_id,'
+    '   merchant_id,'
+    '   aggregator_id,'
+    '   title,'
+    '   product_type,'
+    '   brand,'
+    '   image_link,'
+    '   additional_image_links'
+    ' FROM `{view}`'
+    ' WHERE {sql_filter}'
+    ' LIMIT @product_limit'
+)
+
+_T = TypeVar('_T')
+
 
 class Error(Exception):
   """Base error class for this module."""
@@ -48,6 +104,42 @@ class CloudTasksQueueNotEmptyError(Error):
   """Error when queue has unfinished tasks."""
 
 
+def _run_coroutine(coroutine: Coroutine[Any, Any, _T]) -> _T:
+  """Runs the coroutine to completion from synchronous code.
+
+  If an event loop is already running in this thread (e.g. in a notebook), the
+  coroutine is run on a new event loop in a separate thread instead.
+
+  Args:
+    coroutine: the coroutine to run
+
+  Returns:
+    the result of the coroutine
+  """
+  try:
+    asyncio.get_running_loop()
+  except RuntimeError:
+    return asyncio.run(coroutine)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+    return executor.submit(asyncio.run, coroutine).result()
+
+
+def _products_from_arrow(record_batch: 'pyarrow.RecordBatch') -> list[Product]:
+  """Builds Product dataclasses column-wise from an Arrow record batch."""
+  columns = [
+      record_batch.column(name).to_pylist()
+      for name in common.PRODUCT_FIELD_NAMES
+  ]
+  return [Product(*values) for values in zip(*columns)]
+
+
+def _batched(items: Iterable[_T], batch_size: int) -> Iterator[list[_T]]:
+  """Yields lists of up to batch_size consecutive items."""
+  iterator = iter(items)
+  while batch := list(itertools.islice(iterator, batch_size)):
+    yield batch
+
+
 class ProductPusher:
   """Product pusher class."""
 
@@ -57,6 +149,14 @@ class ProductPusher:
       dataset_id: str,
       location: str,
       queue_id: str,
+      bigquery_client: Optional[bigquery.Client] = None,
+      tasks_client: Optional[tasks_v2.CloudTasksClient] = None,
+      bigquery_storage_client: Optional[
+          bigquery_storage.BigQueryReadClient
+      ] = None,
+      tasks_async_client_factory: Optional[
+          Callable[[], tasks_v2.CloudTasksAsyncClient]
+      ] = None,
   ):
     """Initialize instance of ProductPusher.
 
@@ -65,14 +165,36 @@ class ProductPusher:
       dataset_id: The BigQuery dataset ID.
       location: The Google Cloud location.
       queue_id: The Cloud Tasks queue ID.
+      bigquery_client: The BigQuery client to use, defaults to a new client for
+        the project.
+      tasks_client: The Cloud Tasks client to use, defaults to a new client.
+      bigquery_storage_client: The BigQuery Storage Read API client to use for
+        large reads, defaults to a new client created on first use.
+      tasks_async_client_factory: Creates the async Cloud Tasks client for
+        each push, as the client is bound to the event loop it is used in.
+        Defaults to CloudTasksAsyncClient.
+
+    Raises:
+      CloudTasksPublishError: If there's an issue getting the queue path.
     """
     self.project_id = project_id
     self.dataset_id = dataset_id
     self.location = location
     self.queue_id = queue_id
 
-    self.bigquery_client = bigquery.Client(self.project_id)
-    self.tasks_client = tasks_v2.CloudTasksClient()
+    self.bigquery_client = bigquery_client or bigquery.Client(self.project_id)
+    self.tasks_client = tasks_client or tasks_v2.CloudTasksClient()
+    self.bigquery_storage_client = bigquery_storage_client
+    self.tasks_async_client_factory = (
+        tasks_async_client_factory or tasks_v2.CloudTasksAsyncClient
+    )
+
+    try:
+      self.parent_queue = self.tasks_client.queue_path(
+          self.project_id, self.location, self.queue_id
+      )
+    except Exception as e:  # pylint: disable=broad-exception-caught
+      raise CloudTasksPublishError(f'Failed to resolve queue path: {e}') from e
 
   def is_queue_empty(self) -> bool:
     """Checks if the Google Cloud Tasks queue is empty.
@@ -81,21 +203,71 @@ class ProductPusher:
         True if the queue is empty, False otherwise.
     """
     # List tasks in the queue
-    parent_queue = self.tasks_client.queue_path(
-        self.project_id, self.location, self.queue_id
-    )
     try:
-      request = tasks_v2.ListTasksRequest(parent=parent_queue, page_size=1)
+      request = tasks_v2.ListTasksRequest(
+          parent=self.parent_queue, page_size=1
+      )
       response = self.tasks_client.list_tasks(request=request)
-      return not bool(list(response.tasks))
+      # Only checks the first page, without fetching any further pages.
+      return next(iter(response.tasks), None) is None
     except Exception as e:  # pylint: disable=broad-exception-caught
       raise CloudTasksPublishError(f'Error checking queue status: {e}') from e
 
-  def get_all_products_from_view(
+  def _iter_products(
+      self,
+      query: str,
+      product_limit: int,
+      query_parameters: list[common.QueryParameter],
+  ) -> Iterator[Product]:
+    """Runs a query selecting Product fields and yields the Products.
+
+    Nothing is queried until the iterator is first advanced. Rows are then
+    paged through the REST API as they are consumed, or above
+    STORAGE_API_MIN_ROWS streamed as Arrow record batches with the BigQuery
+    Storage Read API.
+
+    Args:
+      query (str): The GoogleSQL query to run, limited by @product_limit
+      product_limit (int): Maximum number of rows the query returns
+      query_parameters (list[QueryParameter]): Other parameters of the query
+
+    Yields:
+      Product dataclasses
+
+    Raises:
+      BigQueryReadError: if the query fails
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter(
+                'product_limit', 'INT64', product_limit
+            ),
+            *query_parameters,
+        ]
+    )
+    try:
+      query_job = self.bigquery_client.query(query, job_config=job_config)
+      rows = query_job.result()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+      raise BigQueryReadError(f'Failed to read from BigQuery view: {e}') from e
+
+    if product_limit > STORAGE_API_MIN_ROWS:
+      # Created once & reused, as each client holds its own gRPC channel.
+      if self.bigquery_storage_client is None:
+        self.bigquery_storage_client = bigquery_storage.BigQueryReadClient()
+      for record_batch in rows.to_arrow_iterable(
+          bqstorage_client=self.bigquery_storage_client
+      ):
+        yield from _products_from_arrow(record_batch)
+    else:
+      for row in rows:
+        yield Product(**row)
+
+  def iter_all_products_from_view(
       self,
       product_limit: int = 10,
       product_filter: Optional[ProductFilter] = None,
-  ) -> list[Product]:
+  ) -> Iterator[Product]:
     """Retrieves set of products & their images from feed to classify.
 
     This is used when Image Inventory is run on an ad-hoc basis, identifying
@@ -106,41 +278,44 @@ class ProductPusher:
       product_filter (Optional[ProductFilter]): A ProductFilter dataclass
 
     Returns:
-      a list of Product dataclasses
+      an iterator of Product dataclasses, read lazily from BigQuery
     """
-
-    sql_filter = product_filter.get_sql_filter() if product_filter else 'TRUE'
-    query = (
-        'SELECT'
-        '   offer_id,'
-        '   merchant_id,'
-        '   aggregator_id,'
-        '   title,'
-        '   product_type,'
-        '   brand,'
-        '   image_link,'
-        '   additional_image_links'
-        f' FROM `{self.project_id}.{self.dataset_id}.get_all_products_view`'
-        f' WHERE {sql_filter}'
-        f' LIMIT {product_limit}'
+    sql_filter, query_parameters = (
+        product_filter.get_sql_filter() if product_filter else ('TRUE', [])
     )
-    try:
-      query_job = self.bigquery_client.query(query)
-      rows = query_job.result()
-    except Exception as e:  # pylint: disable=broad-exception-caught
-      raise BigQueryReadError(f'Failed to read from BigQuery view: {e}') from e
+    query = PRODUCTS_QUERY_TEMPLATE.format(
+        view=f'{self.project_id}.{self.dataset_id}.get_all_products_view',
+        sql_filter=sql_filter,
+    )
+    return self._iter_products(query, product_limit, query_parameters)
 
-    products = [Product(**row) for row in rows]
+  def get_all_products_from_view(
+      self,
+      product_limit: int = 10,
+      product_filter: Optional[ProductFilter] = None,
+  ) -> list[Product]:
+    """Retrieves products as a list, see iter_all_products_from_view.
+
+    Args:
+      product_limit (int): Maximum number of products to retrieve
+      product_filter (Optional[ProductFilter]): A ProductFilter dataclass
+
+    Returns:
+      a list of Product dataclasses
+    """
+    products = list(
+        self.iter_all_products_from_view(product_limit, product_filter)
+    )
     logging.info(
         'Retrieved %d products from get_all_products_view.', len(products)
     )
     return products
 
-  def get_new_products_from_view(
+  def iter_new_products_from_view(
       self,
       product_limit: int = 10,
       product_filter: Optional[ProductFilter] = None,
-  ) -> list[Product]:
+  ) -> Iterator[Product]:
     """Retrieves set of new unprocessed products & their images to classify.
 
     This is used when Image Inventory is scheduled & running for the full feed,
@@ -151,45 +326,106 @@ class ProductPusher:
       product_filter (Optional[ProductFilter]): A ProductFilter dataclass
 
     Returns:
-      a list of Product dataclasses
+      an iterator of Product dataclasses, read lazily from BigQuery
     """
-    sql_filter = product_filter.get_sql_filter() if product_filter else 'TRUE'
-    query = (
-        'SELECT'
-        '   offer_id,'
-        '   merchant_id,'
-        '   aggregator_id,'
-        '   title,'
-        '   product_type,'
-        '   brand,'
-        '   image_link,'
-        '   additional_image_links'
-        f' FROM `{self.project_id}.{self.dataset_id}.get_new_products_view`'
-        f' WHERE {sql_filter}'
-        f' LIMIT {product_limit}'
+    sql_filter, query_parameters = (
+        product_filter.get_sql_filter() if product_filter else ('TRUE', [])
     )
-    try:
-      query_job = self.bigquery_client.query(query)
-      rows = query_job.result()
-    except Exception as e:  # pylint: disable=broad-exception-caught
-      raise BigQueryReadError(f'Failed to read from BigQuery view: {e}') from e
+    query = PRODUCTS_QUERY_TEMPLATE.format(
+        view=f'{self.project_id}.{self.dataset_id}.get_new_products_view',
+        sql_filter=sql_filter,
+    )
+    return self._iter_products(query, product_limit, query_parameters)
 
-    products = [Product(**row) for row in rows]
+  def get_new_products_from_view(
+      self,
+      product_limit: int = 10,
+      product_filter: Optional[ProductFilter] = None,
+  ) -> list[Product]:
+    """Retrieves products as a list, see iter_new_products_from_view.
+
+    Args:
+      product_limit (int): Maximum number of products to retrieve
+      product_filter (Optional[ProductFilter]): A ProductFilter dataclass
+
+    Returns:
+      a list of Product dataclasses
+    """
+    products = list(
+        self.iter_new_products_from_view(product_limit, product_filter)
+    )
     logging.info(
         'Retrieved %d products from get_new_products_view.', len(products)
     )
     return products
 
-  def push_products(
+  def _build_create_task_request(
       self,
       products: list[Product],
+      http_request_template: dict[str, Any],
+  ) -> tasks_v2.CreateTaskRequest:
+    """Builds the request to create a Cloud Task for a batch of products.
+
+    A single product is sent as a JSON object, a larger batch as a JSON list.
+
+    Args:
+      products (list[Product]): The Product dataclasses to send.
+      http_request_template (dict[str, Any]): The HttpRequest fields shared by
+        all tasks, except for the body.
+
+    Returns:
+      the CreateTaskRequest, with the serialized products as the task body
+    """
+    if len(products) == 1:
+      task_payload = products[0].to_json_bytes()
+    else:
+      task_payload = Product.dumps_many(products)
+    task = tasks_v2.Task(
+        http_request=tasks_v2.HttpRequest(
+            body=task_payload, **http_request_template
+        )
+    )
+    return tasks_v2.CreateTaskRequest(
+        parent=self.parent_queue,
+        task=task,
+    )
+
+  async def _create_task(
+      self,
+      tasks_async_client: tasks_v2.CloudTasksAsyncClient,
+      semaphore: asyncio.Semaphore,
+      request: tasks_v2.CreateTaskRequest,
+  ) -> None:
+    """Creates a Cloud Task, bounded by the semaphore.
+
+    Args:
+      tasks_async_client (CloudTasksAsyncClient): The client to create with.
+      semaphore (asyncio.Semaphore): Bounds the number of RPCs in flight.
+      request (CreateTaskRequest): The prebuilt request to send.
+    """
+    async with semaphore:
+      await tasks_async_client.create_task(
+          request=request, retry=CREATE_TASK_RETRY
+      )
+
+  def push_products(
+      self,
+      products: Iterable[Product],
       cloud_function_url: str,
+      batch_size: int = 1,
+      log_tracebacks: bool = False,
   ) -> Tuple[int, int]:
     """Pushes products to Cloud Tasks, attempting all products even if some fail.
 
+    Synchronous wrapper of push_products_async. Task creation errors are logged
+    together once all tasks are attempted.
+
     Args:
-      products (list[Product]): A list of Product dataclasses.
+      products (Iterable[Product]): The Product dataclasses, e.g. a list or
+        an iterator from iter_new_products_from_view.
       cloud_function_url (str): The URL of the Cloud Function to call.
+      batch_size (int): Number of products to send per task.
+      log_tracebacks (bool): Whether to log the traceback of each failure.
 
     Returns:
         A tuple containing:
@@ -197,53 +433,94 @@ class ProductPusher:
           - failure_count (int): Number of products that failed to push.
 
     Raises:
-        CloudTasksPublishError: If there's an issue getting the queue path.
-                                Individual task creation errors are logged.
+      ValueError: if batch_size is less than 1.
     """
-    success_count = 0
-    failure_count = 0
-    failed_products: List[Tuple[Product, str]] = []
+    return _run_coroutine(
+        self.push_products_async(
+            products, cloud_function_url, batch_size, log_tracebacks
+        )
+    )
 
-    try:
-      parent_queue = self.tasks_client.queue_path(
-          self.project_id, self.location, self.queue_id
-      )
-    except Exception as e:  # pylint: disable=broad-exception-caught
-      raise CloudTasksPublishError(f'Failed to resolve queue path: {e}') from e
+  async def push_products_async(
+      self,
+      products: Iterable[Product],
+      cloud_function_url: str,
+      batch_size: int = 1,
+      log_tracebacks: bool = False,
+  ) -> Tuple[int, int]:
+    """Pushes products to Cloud Tasks, attempting all even if some fail.
 
-    logging.info(
-        'Attempting to push %d products to Cloud Tasks queue: %s',
-        len(products),
-        parent_queue,
-    )
+    Products are grouped into tasks of batch_size products, and up to
+    MAX_PUSH_CONCURRENCY tasks are created concurrently with the async
+    Cloud Tasks client. Products are read on a worker thread, so tasks are
+    created while an iterator of products is still being read from BigQuery.
+    The client is bound to the running event loop, so it is created for each
+    call. Task creation errors are logged together once all tasks are attempted.
 
-    for product in products:
-      try:
-        task_payload = product.to_json().encode('utf-8')
-        task = tasks_v2.Task(
-            http_request=tasks_v2.HttpRequest(
-                http_method=tasks_v2.HttpMethod.POST,
-                url=cloud_function_url,
-                body=task_payload,
-                headers={
-                    'Content-type': 'application/json',
-                },
-            )
-        )
-        request = tasks_v2.CreateTaskRequest(
-            parent=parent_queue,
-            task=task,
-        )
-        self.tasks_client.create_task(request=request)
-        success_count += 1
+    Args:
+      products (Iterable[Product]): The Product dataclasses, e.g. a list or
+        an iterator from iter_new_products_from_view.
+      cloud_function_url (str): The URL of the Cloud Function to call.
+      batch_size (int): Number of products to send per task.
+      log_tracebacks (bool): Whether to log the traceback of each failure.
+
+    Returns:
+        A tuple containing:
+          - success_count (int): Number of products successfully pushed.
+          - failure_count (int): Number of products that failed to push.
 
-      except Exception as e:  # pylint: disable=broad-exception-caught
-        failure_count += 1
-        error_message = (
-            f'Failed to create task for product ID {product.offer_id}: {e}'
+    Raises:
+      ValueError: if batch_size is less than 1.
+    """
+    if batch_size < 1:
+      raise ValueError(f'batch_size must be at least 1, got {batch_size}.')
+    success_count = 0
+    failure_count = 0
+    failures: List[dict[str, str]] = []
+
+    logging.info('Pushing products to Cloud Tasks queue: %s', self.parent_queue)
+    http_request_template = {
+        'http_method': tasks_v2.HttpMethod.POST,
+        'url': cloud_function_url,
+        'headers': {
+            'Content-type': 'application/json',
+        },
+    }
+
+    batch_iterator = _batched(products, batch_size)
+    batches = []
+    create_task_futures = []
+    tasks_async_client = self.tasks_async_client_factory()
+    semaphore = asyncio.Semaphore(MAX_PUSH_CONCURRENCY)
+    try:
+      while batch := await asyncio.to_thread(next, batch_iterator, None):
+        batches.append(batch)
+        # Each payload is serialized once, so nothing is re-encoded while
+        # RPCs are in flight or retried.
+        request = self._build_create_task_request(batch, http_request_template)
+        create_task_futures.append(
+            asyncio.ensure_future(
+                self._create_task(tasks_async_client, semaphore, request)
+            )
         )
-        logging.error(error_message, exc_info=True)
-        failed_products.append((product, error_message))
+    finally:
+      # Tasks already started are awaited even if reading products failed.
+      results = await asyncio.gather(
+          *create_task_futures, return_exceptions=True
+      )
+      await tasks_async_client.transport.close()
+
+    # Failures are logged once at the end rather than per task, so a mass
+    # failure doesn't emit (and format) a traceback per product.
+    for batch, result in zip(batches, results):
+      if isinstance(result, Exception):
+        failure_count += len(batch)
+        failure = {'error': repr(result)}
+        if log_tracebacks:
+          failure['traceback'] = ''.join(traceback.format_exception(result))
+        failures.extend({'offer_id': p.offer_id, **failure} for p in batch)
+      else:
+        success_count += len(batch)
 
     logging.info(
         'Finished pushing products. Success: %d, Failures: %d',
@@ -251,13 +528,14 @@ class ProductPusher:
         failure_count,
     )
 
-    if failed_products:
+    if failures:
       logging.warning(
-          '%d products failed to queue. See previous error logs for details.',
+          '%d products failed to queue.',
           failure_count,
           extra={
               'json_fields': {
-                  'failed_offer_ids': [p.offer_id for p, _ in failed_products]
+                  'failed_offer_ids': [f['offer_id'] for f in failures],
+                  'failures': failures,
               }
           },
       )
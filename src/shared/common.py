@@ -16,7 +16,20 @@
 
 import dataclasses
 import json
-from typing import Optional
+from typing import Any, Optional
+
+from google.cloud import bigquery
+
+try:
+  import orjson  # pylint: disable=g-import-not-at-top
+except ImportError:
+  # Products are serialized with the standard library if orjson isn't
+  # installed, e.g. when the shared module is imported outside of the
+  # deployed Cloud Functions.
+  orjson = None
+
+
+QueryParameter = bigquery.ScalarQueryParameter | bigquery.ArrayQueryParameter
 
 
 class Error(Exception):
@@ -27,9 +40,15 @@ class ProductFilterError(Error):
   """Error when product filter is invalid."""
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, frozen=True)
 class Product:
-  """Product data class."""
+  """Product data class.
+
+  Products are immutable and hashable, so identical products can be
+  deduplicated with sets or used as dict keys. The hash only covers
+  (offer_id, merchant_id), but equality compares every field, so products with
+  the same IDs that differ in any other field are kept apart.
+  """
 
   offer_id: str
   merchant_id: int
@@ -40,36 +59,126 @@ class Product:
   image_link: Optional[str]
   additional_image_links: list[str]
 
+  def __hash__(self) -> int:
+    # additional_image_links is a list and can't be hashed.
+    return hash((self.offer_id, self.merchant_id))
+
+  def to_dict(self) -> dict[str, Any]:
+    """Returns a dictionary representation of the Product.
+
+    Built by hand rather than with dataclasses.asdict, which deep copies every
+    field. Only the additional_image_links list needs copying, so changes to
+    the dictionary don't alter the frozen Product.
+    """
+    return {
+        'offer_id': self.offer_id,
+        'merchant_id': self.merchant_id,
+        'aggregator_id': self.aggregator_id,
+        'title': self.title,
+        'product_type': self.product_type,
+        'brand': self.brand,
+        'image_link': self.image_link,
+        'additional_image_links': list(self.additional_image_links),
+    }
+
   def to_json(self) -> str:
     """Returns a JSON string representation of the Product."""
-    return json.dumps(dataclasses.asdict(self))
+    if orjson is None:
+      return json.dumps(self.to_dict())
+    return orjson.dumps(self.to_dict()).decode('utf-8')
+
+  def to_json_bytes(self) -> bytes:
+    """Returns the Product as UTF-8 encoded JSON, e.g. for request bodies."""
+    if orjson is None:
+      return json.dumps(self.to_dict()).encode('utf-8')
+    return orjson.dumps(self.to_dict())
+
+  @classmethod
+  def dumps_many(cls, products: list['Product']) -> bytes:
+    """Returns the Products as a UTF-8 encoded JSON list.
+
+    The whole list is serialized in a single call rather than per Product.
+
+    Args:
+      products (list[Product]): The Products to serialize.
+
+    Returns:
+      the JSON list of the Products' dictionary representations
+    """
+    product_dicts = [product.to_dict() for product in products]
+    if orjson is None:
+      return json.dumps(product_dicts).encode('utf-8')
+    return orjson.dumps(product_dicts)
+
 
+# Product field names in declaration order, computed once rather than
+# introspecting the dataclass on every use.
+PRODUCT_FIELD_NAMES = tuple(field.name for field in dataclasses.fields(Product))
 
-@dataclasses.dataclass
+
+@dataclasses.dataclass(slots=True, frozen=True)
 class ProductFilter:
   """Product filter dataclass."""
 
   product_type: Optional[str] = None
   brands: Optional[list[str]] = None
   offer_ids: Optional[list[str]] = None
+  _sql_filter: tuple[str, tuple[QueryParameter, ...]] = dataclasses.field(
+      init=False, repr=False, compare=False
+  )
 
   def __post_init__(self) -> None:
     if not self.product_type and not self.brands and not self.offer_ids:
       raise ProductFilterError(
           'At least one of product_type, brands, or offer_ids must be set.'
       )
+    # Values are normalized once here rather than per generated query. The
+    # filter is frozen so the cached SQL filter can't go stale, hence the
+    # object.__setattr__ calls.
+    if self.product_type:
+      object.__setattr__(self, 'product_type', self.product_type.lower())
+    if self.brands:
+      object.__setattr__(
+          self, 'brands', [b.strip().lower() for b in self.brands]
+      )
+    if self.offer_ids:
+      object.__setattr__(
+          self, 'offer_ids', [s.strip().lower() for s in self.offer_ids]
+      )
+    object.__setattr__(self, '_sql_filter', self._build_sql_filter())
 
-  def get_sql_filter(self) -> str:
-    """Generates GoogleSQL WHERE clause based on filter settings."""
+  def get_sql_filter(self) -> tuple[str, list[QueryParameter]]:
+    """Returns a parameterized GoogleSQL WHERE clause from filter settings.
+
+    Filter values are passed as query parameters rather than inlined, so they
+    can't alter the query and the query text is the same for any values. The
+    clause is built once, when the filter is created.
+
+    Returns:
+      a tuple of the WHERE clause and the query parameters it references
+    """
+    sql_filter, query_parameters = self._sql_filter
+    return sql_filter, list(query_parameters)
+
+  def _build_sql_filter(self) -> tuple[str, tuple[QueryParameter, ...]]:
+    """Builds the WHERE clause and query parameters for get_sql_filter."""
     product_filters = []
+    query_parameters = []
     if self.product_type:
-      product_filters.append(
-          f'LOWER(product_type) LIKE "{self.product_type.lower()}%"'
+      product_filters.append('LOWER(product_type) LIKE @product_type_prefix')
+      query_parameters.append(
+          bigquery.ScalarQueryParameter(
+              'product_type_prefix', 'STRING', f'{self.product_type}%'
+          )
       )
     if self.brands:
-      brand_list = ','.join([f'"{b.strip().lower() }"' for b in self.brands])
-      product_filters.append(f'LOWER(brand) IN ({brand_list})')
+      product_filters.append('LOWER(brand) IN UNNEST(@brands)')
+      query_parameters.append(
+          bigquery.ArrayQueryParameter('brands', 'STRING', self.brands)
+      )
     if self.offer_ids:
-      offer_list = ','.join([f'"{s.strip().lower()}"' for s in self.offer_ids])
-      product_filters.append(f'LOWER(offer_id) IN ({offer_list})')
-    return '\n AND '.join(product_filters)
+      product_filters.append('LOWER(offer_id) IN UNNEST(@offer_ids)')
+      query_parameters.append(
+          bigquery.ArrayQueryParameter('offer_ids', 'STRING', self.offer_ids)
+      )
+    return '\n AND '.join(product_filters), tuple(query_parameters)
@@ -85,10 +85,11 @@ module "functions_classify_product" {
   entry_point           = "run"
   runtime               = "python311"
   environment_variables = {
-    PROJECT_ID = data.google_project.project.name
-    DATASET_ID = module.bigquery.dataset_id
-    TABLE_NAME = var.bigquery_table_name
-    MODEL_NAME = var.model_name
+    PROJECT_ID           = data.google_project.project.name
+    DATASET_ID           = module.bigquery.dataset_id
+    TABLE_NAME           = var.bigquery_table_name
+    MODEL_NAME           = var.model_name
+    SWATCH_MAX_DIMENSION = var.swatch_max_dimension
   }
   secret_environment_variables = {
     gemini_api_key = {
@@ -117,6 +118,7 @@ module "functions_push_products" {
     LOCATION              = var.location
     CLOUD_FUNCTION_URL    = module.functions_classify_product.function_url
     SERVICE_ACCOUNT_EMAIL = google_service_account.service_account.email
+    TASK_BATCH_SIZE       = var.task_batch_size
   }
   max_instance_count = 1
   available_memory   = "256M"
@@ -16,22 +16,43 @@
 
 import enum
 import json
-from typing import Dict, List, TypedDict, get_type_hints
+from typing import (
+    Dict,
+    List,
+    Optional,
+    TypedDict,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
 
 from config.structured_output import LabeledImage
 
 
-AllowedTypes = [
-    str,
-    enum.Enum,
-    int,
-    float,
-    bool,
-    list[str],
-    list[int],
-    list[float],
-    list[enum.Enum],
-]
+# BigQuery column types of the supported field types. Enums, which can't be
+# looked up by type, are stored as STRING. Any other type is rejected.
+_BIGQUERY_TYPES = {
+    str: "STRING",
+    int: "INTEGER",
+    float: "FLOAT",
+    bool: "BOOLEAN",
+}
+_BIGQUERY_LIST_ELEMENT_TYPES = {
+    str: "STRING",
+    int: "INTEGER",
+    float: "FLOAT",
+}
+
+
+def _get_bigquery_type(
+    field_type: type, bigquery_types: Dict[type, str]
+) -> Optional[str]:
+  """Returns the BigQuery type of a field type, or None if unsupported."""
+  if field_type in bigquery_types:
+    return bigquery_types[field_type]
+  if isinstance(field_type, type) and issubclass(field_type, enum.Enum):
+    return "STRING"
+  return None
 
 
 def default_schema_fields() -> List[Dict[str, str]]:
@@ -83,57 +104,21 @@ def generate_bigquery_schema_string(
 
   schema = default_schema_fields()
   for field_name, field_type in get_type_hints(labeled_image_class).items():
-    if field_type is str or (
-        hasattr(field_type, "__mro__") and enum.Enum in field_type.__mro__
-    ):
-      schema.append({
-          "name": field_name,
-          "type": "STRING",
-          "mode": "NULLABLE",
-      })
-    elif field_type is int:
-      schema.append({
-          "name": field_name,
-          "type": "INTEGER",
-          "mode": "NULLABLE",
-      })
-    elif field_type is float:
-      schema.append({
-          "name": field_name,
-          "type": "FLOAT",
-          "mode": "NULLABLE",
-      })
-    elif field_type is bool:
-      schema.append({
-          "name": field_name,
-          "type": "BOOLEAN",
-          "mode": "NULLABLE",
-      })
-    # Check if the field type is a list
-    elif hasattr(field_type, "__origin__") and field_type.__origin__ is list:
-      element_type = field_type.__args__[0]
-      if element_type is str or (
-          hasattr(element_type, "__mro__") and enum.Enum in element_type.__mro__
-      ):
-        schema.append({
-            "name": field_name,
-            "type": "STRING",
-            "mode": "REPEATED",
-        })
-      elif element_type is int:
-        schema.append({
-            "name": field_name,
-            "type": "INTEGER",
-            "mode": "REPEATED",
-        })
-      elif element_type is float:
-        schema.append({
-            "name": field_name,
-            "type": "FLOAT",
-            "mode": "REPEATED",
-        })
+    if get_origin(field_type) is list:
+      bigquery_type = _get_bigquery_type(
+          get_args(field_type)[0], _BIGQUERY_LIST_ELEMENT_TYPES
+      )
+      mode = "REPEATED"
     else:
+      bigquery_type = _get_bigquery_type(field_type, _BIGQUERY_TYPES)
+      mode = "NULLABLE"
+    if bigquery_type is None:
       raise TypeError(f"Unsupported type for field {field_name}: {field_type}")
+    schema.append({
+        "name": field_name,
+        "type": bigquery_type,
+        "mode": mode,
+    })
 
   return json.dumps(schema)
 
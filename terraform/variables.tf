@@ -17,6 +17,11 @@ variable "model_name" {
   default = "gemini-2.5-flash"
 }
 
+variable "swatch_max_dimension" {
+  type    = number
+  default = 0
+}
+
 variable "bigquery_dataset_id" {
   type    = string
   default = "image_inventory"
@@ -32,6 +37,11 @@ variable "product_limit" {
   default = 100
 }
 
+variable "task_batch_size" {
+  type    = number
+  default = 1
+}
+
 variable "location" {
   type    = string
   default = "us-central1"
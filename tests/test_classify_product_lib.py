@@ -14,23 +14,20 @@
 
 """Unit tests for the classify_product_lib library."""
 
+import asyncio
+import concurrent.futures
 import datetime
 import hashlib
 import json
-import os
-import sys
 import unittest
 from unittest import mock
+from config.structured_output import ImageType
 from config.structured_output import LabeledImage
 from google import genai
-from google.cloud import bigquery
+from google.genai import errors as genai_errors
 from google.genai import types
 import requests
 
-# To avoid relative symlink issues, get the absolute path to 'src' directory
-src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
-sys.path.insert(0, src_path)
-
 from shared.common import Product  # pylint: disable=g-import-not-at-top
 from src.classify_product import classify_product_lib  # pylint: disable=g-import-not-at-top
 
@@ -38,12 +35,23 @@ from src.classify_product import classify_product_lib  # pylint: disable=g-impor
 class TestClassifyProductLib(unittest.TestCase):
   """Unit tests for the classify_product_lib library."""
 
+  @classmethod
+  def setUpClass(cls):
+    """Set up the immutable fixtures shared by all tests."""
+    super().setUpClass()
+
+    cls.mock_prompt = 'Test prompt'
+    cls.mock_model_name = 'gemini-1.0-pro-vision-latest'
+    cls.mock_table_id = 'test_project.test_dataset.test_table'
+
   def setUp(self):
     """Set up test environment."""
     super().setUp()
 
     self.mock_http_session = mock.MagicMock(spec=requests.Session)
-    self.mock_bigquery_client = mock.Mock(spec=bigquery.Client)
+    # Only insert_rows_json is used, so the full bigquery.Client spec isn't
+    # introspected for every test.
+    self.mock_bigquery_client = mock.Mock(spec_set=['insert_rows_json'])
     self.mock_genai_client = mock.Mock(spec=genai.Client)
 
     self.product1 = Product(
@@ -76,60 +84,58 @@ class TestClassifyProductLib(unittest.TestCase):
         mime_type='image/jpeg',
         width=100,
         height=100,
-        sha256_hash='test_hash',
+        sha256_hash='test_hash_2',
     )
 
-    self.mock_prompt = 'Test prompt'
-    self.mock_model_name = 'gemini-1.0-pro-vision-latest'
-    self.mock_table_id = 'test_project.test_dataset.test_table'
-
     self.product_classifier = self.get_class_under_test()
 
   def get_class_under_test(self):
-    with mock.patch('requests.Session') as mock_http_client:
-      with mock.patch('google.cloud.bigquery.Client') as mock_bigquery_client:
-        with mock.patch('google.genai.Client') as mock_genai_client:
-          mock_http_client.return_value = self.mock_http_session
-          mock_bigquery_client.return_value = self.mock_bigquery_client
-          mock_genai_client.return_value = self.mock_genai_client
-
-          return classify_product_lib.ProductClassifier(
-              prompt=self.mock_prompt,
-              model_name=self.mock_model_name,
-              table_id=self.mock_table_id,
-          )
+    return classify_product_lib.ProductClassifier(
+        prompt=self.mock_prompt,
+        model_name=self.mock_model_name,
+        table_id=self.mock_table_id,
+        http_session=self.mock_http_session,
+        bigquery_client=self.mock_bigquery_client,
+        genai_client=self.mock_genai_client,
+    )
+
+  def get_mock_image_response(self, content: bytes) -> mock.MagicMock:
+    """Returns a mock streamed HTTP response serving the content in 2 chunks."""
+    mock_response = mock.MagicMock()
+    mock_response.__enter__.return_value = mock_response
+    mock_response.headers = {'content-type': 'image/jpeg'}
+    mock_response.iter_content.return_value = [content[:11], content[11:]]
+    self.mock_http_session.get.return_value = mock_response
+    return mock_response
 
   def test_processed_image_to_json(self):
     """Test the to_json method of the ProcessedImage class."""
     self.assertEqual(
-        self.processed_image1.to_json(),
-        json.dumps({
+        json.loads(self.processed_image1.to_json()),
+        {
             'image_link': 'http://image1.com',
             'mime_type': 'image/jpeg',
             'width': 100,
             'height': 100,
             'sha256_hash': 'test_hash',
             'labeled_image': None,
-        }),
+        },
     )
 
   def test_process_image_success(self):
     """Test process_image function with successful image processing."""
 
-    mock_response = mock.MagicMock()
-    mock_response.content = b'test image content'
-    mock_response.headers = {'content-type': 'image/jpeg'}
-    self.mock_http_session.get.return_value = mock_response
-
-    mock_genai_file_reference = mock.MagicMock(spec=types.File)
-    self.mock_genai_client.files.upload.return_value = mock_genai_file_reference
+    mock_response = self.get_mock_image_response(b'test image content')
 
     with mock.patch('io.BytesIO') as mock_bytes_io:
       with mock.patch('PIL.Image.open') as mock_image_open:
         mock_file = mock.MagicMock()
+        mock_file.tell.return_value = len(b'test image content')
+        mock_file.getvalue.return_value = b'test image content'
         mock_bytes_io.return_value = mock_file
 
         mock_image = mock.MagicMock()
+        mock_image.__enter__.return_value = mock_image
         mock_image.size = (100, 100)
         mock_image_open.return_value = mock_image
 
@@ -138,38 +144,113 @@ class TestClassifyProductLib(unittest.TestCase):
         )
 
     self.mock_http_session.get.assert_called_once_with(
-        'http://image1.com', headers=self.product_classifier.http_headers
+        'http://image1.com',
+        headers=self.product_classifier.http_headers,
+        stream=True,
     )
-    self.mock_genai_client.files.upload.assert_called_once_with(
-        file=mock_file, config={'mime_type': 'image/jpeg'}
+    mock_response.iter_content.assert_called_once_with(
+        chunk_size=classify_product_lib.DOWNLOAD_CHUNK_SIZE
+    )
+    mock_file.write.assert_has_calls(
+        [mock.call(b'test image '), mock.call(b'content')]
     )
+    self.mock_genai_client.files.upload.assert_not_called()
     self.assertEqual(
         return_value,
         classify_product_lib.ProcessedImage(
             image_link='http://image1.com',
-            genai_file_reference=mock_genai_file_reference,
+            genai_file_reference=types.Part.from_bytes(
+                data=b'test image content', mime_type='image/jpeg'
+            ),
             mime_type='image/jpeg',
             width=100,
             height=100,
-            sha256_hash=hashlib.sha256(mock_response.content).hexdigest(),
+            sha256_hash=hashlib.sha256(b'test image content').hexdigest(),
         ),
     )
 
+  @mock.patch.object(classify_product_lib, 'INLINE_IMAGE_MAX_BYTES', 10)
+  def test_process_image_large_image_upload(self):
+    """Test process_image uploads images too large to send inline."""
+    self.get_mock_image_response(b'test image content')
+    mock_genai_file_reference = mock.MagicMock(spec=types.File)
+    self.mock_genai_client.files.upload.return_value = mock_genai_file_reference
+
+    with mock.patch('PIL.Image.open') as mock_image_open:
+      mock_image_open.return_value.__enter__.return_value.size = (100, 100)
+      return_value = self.product_classifier.process_image('http://image1.com')
+
+    self.mock_genai_client.files.upload.assert_called_once_with(
+        file=mock.ANY, config={'mime_type': 'image/jpeg'}
+    )
+    self.assertEqual(
+        return_value.genai_file_reference, mock_genai_file_reference
+    )
+
+  # Room for two 3 byte images, which are 4 bytes each once base64 encoded.
+  @mock.patch.object(classify_product_lib, 'INLINE_REQUEST_MAX_BYTES', 8)
+  def test_upload_images_over_inline_budget(self):
+    """Test inline images over the product's request budget are uploaded."""
+    processed_images = [
+        classify_product_lib.ProcessedImage(
+            image_link=f'http://image{i}.com',
+            genai_file_reference=types.Part.from_bytes(
+                data=f'ab{i}'.encode(), mime_type='image/jpeg'
+            ),
+            mime_type='image/jpeg',
+            width=100,
+            height=100,
+            sha256_hash=f'test_hash_{i}',
+        )
+        for i in range(3)
+    ]
+    inline_parts = [pi.genai_file_reference for pi in processed_images]
+    mock_genai_file_reference = mock.MagicMock(spec=types.File)
+    self.mock_genai_client.files.upload.return_value = mock_genai_file_reference
+
+    self.product_classifier.upload_images_over_inline_budget(processed_images)
+
+    self.assertEqual(
+        [pi.genai_file_reference for pi in processed_images],
+        inline_parts[:2] + [mock_genai_file_reference],
+    )
+    self.mock_genai_client.files.upload.assert_called_once_with(
+        file=mock.ANY, config={'mime_type': 'image/jpeg'}
+    )
+    uploaded_file = self.mock_genai_client.files.upload.call_args.kwargs['file']
+    self.assertEqual(uploaded_file.getvalue(), b'ab2')
+
   def test_process_image_pull_error(self):
     """Test process_image function with image pull error."""
     self.mock_http_session.get.side_effect = Exception('Image pull error')
     with self.assertRaises(classify_product_lib.ImagePullError):
       self.product_classifier.process_image('http://image1.com')
 
+  @mock.patch.object(classify_product_lib, 'INLINE_IMAGE_MAX_BYTES', 10)
   def test_process_image_genai_error(self):
     """Test process_image function with genai error."""
-    mock_response = mock.MagicMock()
-    mock_response.content = b'test image content'
-    mock_response.headers = {'content-type': 'image/jpeg'}
-    self.mock_http_session.get.return_value = mock_response
+    self.get_mock_image_response(b'test image content')
     self.mock_genai_client.files.upload.side_effect = Exception('genai error')
-    with self.assertRaises(classify_product_lib.GenerativeAIError):
-      self.product_classifier.process_image('http://image1.com')
+    with mock.patch('PIL.Image.open') as mock_image_open:
+      mock_image_open.return_value.__enter__.return_value.size = (100, 100)
+      with self.assertRaises(classify_product_lib.GenerativeAIError):
+        self.product_classifier.process_image('http://image1.com')
+
+  def test_process_image_cached_label(self):
+    """Test process_image skips the Gemini upload for cached images."""
+    self.get_mock_image_response(b'test image content')
+    sha256_hash = hashlib.sha256(b'test image content').hexdigest()
+    self.product_classifier.label_cache.put(
+        sha256_hash, LabeledImage(type='silo')
+    )
+
+    with mock.patch('PIL.Image.open') as mock_image_open:
+      mock_image_open.return_value.__enter__.return_value.size = (100, 100)
+      return_value = self.product_classifier.process_image('http://image1.com')
+
+    self.mock_genai_client.files.upload.assert_not_called()
+    self.assertIsNone(return_value.genai_file_reference)
+    self.assertEqual(return_value.labeled_image, LabeledImage(type='silo'))
 
   def test_run_multimodal_query(self):
     """Test run_multimodal_query function."""
@@ -188,7 +269,7 @@ class TestClassifyProductLib(unittest.TestCase):
     return_value = self.product_classifier.run_multimodal_query(
         self.product1, processed_images
     )
-    self.assertEqual(return_value, mock_genai_response.text)
+    self.assertEqual(return_value, mock_genai_response)
     self.assertEqual(
         [processed_images[0].labeled_image, processed_images[1].labeled_image],
         mock_labeled_images,
@@ -203,10 +284,122 @@ class TestClassifyProductLib(unittest.TestCase):
         ],
         config=self.product_classifier.genai_config,
     )
-    self.mock_genai_client.files.delete.assert_has_calls([
-        mock.call(name=self.mock_genai_file_ref_1.name),
-        mock.call(name=self.mock_genai_file_ref_2.name),
-    ])
+    self.mock_genai_client.files.delete.assert_not_called()
+
+  def test_run_multimodal_query_unparsed_response(self):
+    """Test run_multimodal_query decodes the text if parsing failed."""
+    mock_genai_response = mock.MagicMock()
+    mock_genai_response.parsed = None
+    mock_genai_response.text = '[{"type": "silo"}, {"type": "lifestyle"}]'
+    self.mock_genai_client.models.generate_content.return_value = (
+        mock_genai_response
+    )
+
+    self.product_classifier.run_multimodal_query(
+        self.product1, [self.processed_image1, self.processed_image2]
+    )
+
+    self.assertEqual(
+        self.processed_image1.labeled_image, LabeledImage(type='silo')
+    )
+    self.assertEqual(
+        self.processed_image2.labeled_image, LabeledImage(type='lifestyle')
+    )
+
+  def test_run_multimodal_query_skips_labeled_images(self):
+    """Test run_multimodal_query only sends unlabeled images to Gemini."""
+    mock_genai_response = mock.MagicMock()
+    mock_genai_response.parsed = [LabeledImage(type='lifestyle')]
+    self.mock_genai_client.models.generate_content.return_value = (
+        mock_genai_response
+    )
+    self.processed_image1.labeled_image = LabeledImage(type='silo')
+
+    self.product_classifier.run_multimodal_query(
+        self.product1, [self.processed_image1, self.processed_image2]
+    )
+
+    self.mock_genai_client.models.generate_content.assert_called_once_with(
+        model=self.product_classifier.model_name,
+        contents=[self.mock_genai_file_ref_2, mock.ANY],
+        config=self.product_classifier.genai_config,
+    )
+    self.assertEqual(
+        self.product_classifier.label_cache.get('test_hash_2'),
+        LabeledImage(type='lifestyle'),
+    )
+
+  def test_run_multimodal_query_deduplicates_images(self):
+    """Test run_multimodal_query sends identical images to Gemini once."""
+    mock_genai_response = mock.MagicMock()
+    mock_genai_response.parsed = [LabeledImage(type='silo')]
+    self.mock_genai_client.models.generate_content.return_value = (
+        mock_genai_response
+    )
+    self.processed_image2.sha256_hash = 'test_hash'
+
+    self.product_classifier.run_multimodal_query(
+        self.product1, [self.processed_image1, self.processed_image2]
+    )
+
+    self.mock_genai_client.models.generate_content.assert_called_once_with(
+        model=self.product_classifier.model_name,
+        contents=[self.mock_genai_file_ref_1, mock.ANY],
+        config=self.product_classifier.genai_config,
+    )
+    self.assertEqual(
+        self.processed_image1.labeled_image, LabeledImage(type='silo')
+    )
+    self.assertEqual(
+        self.processed_image2.labeled_image, LabeledImage(type='silo')
+    )
+
+  def test_run_multimodal_query_labels_swatches(self):
+    """Test run_multimodal_query labels swatches without querying Gemini."""
+    mock_genai_response = mock.MagicMock()
+    mock_genai_response.parsed = [LabeledImage(type='lifestyle')]
+    self.mock_genai_client.models.generate_content.return_value = (
+        mock_genai_response
+    )
+    self.processed_image2.width = 800
+    self.assertFalse(self.product_classifier.is_swatch(self.processed_image1))
+    self.product_classifier.swatch_max_dimension = 200
+
+    self.product_classifier.run_multimodal_query(
+        self.product1, [self.processed_image1, self.processed_image2]
+    )
+
+    self.mock_genai_client.models.generate_content.assert_called_once_with(
+        model=self.product_classifier.model_name,
+        contents=[self.mock_genai_file_ref_2, mock.ANY],
+        config=self.product_classifier.genai_config,
+    )
+    self.assertEqual(
+        self.processed_image1.labeled_image,
+        LabeledImage(type=ImageType.SWATCH),
+    )
+
+  def test_run_multimodal_query_all_images_labeled(self):
+    """Test run_multimodal_query does not call Gemini if nothing to label."""
+    self.processed_image1.labeled_image = LabeledImage(type='silo')
+    self.assertIsNone(
+        self.product_classifier.run_multimodal_query(
+            self.product1, [self.processed_image1]
+        )
+    )
+    self.mock_genai_client.models.generate_content.assert_not_called()
+
+  def test_label_cache_evicts_least_recently_used(self):
+    """Test the LabelCache evicts the least recently used entry."""
+    label_cache = classify_product_lib.LabelCache(max_size=2)
+    label_cache.put('hash1', LabeledImage(type='silo'))
+    label_cache.put('hash2', LabeledImage(type='group'))
+    label_cache.get('hash1')
+    label_cache.put('hash3', LabeledImage(type='swatch'))
+
+    self.assertIsNone(label_cache.get('hash2'))
+    self.assertEqual(label_cache.get('hash1'), LabeledImage(type='silo'))
+    self.assertEqual(label_cache.get('hash3'), LabeledImage(type='swatch'))
 
   def test_run_multimodal_query_genai_error(self):
     """Test run_multimodal_query function with genai error."""
@@ -219,6 +412,36 @@ class TestClassifyProductLib(unittest.TestCase):
           self.product1, processed_images
       )
 
+  def test_delete_uploaded_files(self):
+    """Test delete_uploaded_files function."""
+    self.mock_genai_client.files.delete.side_effect = [
+        Exception('delete error'),
+        None,
+    ]
+    inline_image = classify_product_lib.ProcessedImage(
+        image_link='http://image3.com',
+        genai_file_reference=types.Part.from_bytes(
+            data=b'test image content', mime_type='image/jpeg'
+        ),
+        mime_type='image/jpeg',
+        width=100,
+        height=100,
+        sha256_hash='test_hash',
+    )
+    futures = self.product_classifier.delete_uploaded_files(
+        [self.processed_image1, inline_image, self.processed_image2]
+    )
+    concurrent.futures.wait(futures)
+
+    self.assertEqual(len(futures), 2)
+    self.mock_genai_client.files.delete.assert_has_calls(
+        [
+            mock.call(name=self.mock_genai_file_ref_1.name),
+            mock.call(name=self.mock_genai_file_ref_2.name),
+        ],
+        any_order=True,
+    )
+
   def test_write_result_to_bigquery(self):
     """Test write_result_to_bigquery function."""
 
@@ -229,9 +452,7 @@ class TestClassifyProductLib(unittest.TestCase):
     mock_insertion_datetime = datetime.datetime(
         2025, 3, 11, 21, 15, 37, tzinfo=datetime.timezone.utc
     )
-    mock_insertion_timestamp = mock_insertion_datetime.strftime(
-        '%Y-%m-%d %H:%M:%S'
-    )
+    mock_insertion_timestamp = '2025-03-11 21:15:37+00:00'
     self.mock_bigquery_client.insert_rows_json.return_value = []
 
     with mock.patch(
@@ -240,6 +461,10 @@ class TestClassifyProductLib(unittest.TestCase):
       mock_datetime.datetime.now.return_value = mock_insertion_datetime
       self.product_classifier.write_result_to_bigquery(processed_images)
 
+    # Rows are buffered until the batch is flushed.
+    self.mock_bigquery_client.insert_rows_json.assert_not_called()
+    self.product_classifier.bigquery_batcher.flush()
+
     expected_rows = [
         {
             'image_link': 'http://image1.com',
@@ -255,13 +480,13 @@ class TestClassifyProductLib(unittest.TestCase):
             'mime_type': 'image/jpeg',
             'width': 100,
             'height': 100,
-            'sha256_hash': 'test_hash',
+            'sha256_hash': 'test_hash_2',
             'type': 'lifestyle',
             'timestamp': mock_insertion_timestamp,
         },
     ]
     self.mock_bigquery_client.insert_rows_json.assert_called_once_with(
-        self.mock_table_id, expected_rows
+        self.mock_table_id, expected_rows, row_ids=mock.ANY
     )
 
   def test_write_result_to_bigquery_error(self):
@@ -270,9 +495,115 @@ class TestClassifyProductLib(unittest.TestCase):
         'BigQuery error'
     )
     self.processed_image1.labeled_image = LabeledImage(type='silo')
+    self.product_classifier.write_result_to_bigquery([self.processed_image1])
     with self.assertRaises(classify_product_lib.BigQueryWriteError):
-      self.product_classifier.write_result_to_bigquery([self.processed_image1])
+      self.product_classifier.bigquery_batcher.flush()
 
+  def test_bigquery_batcher_flushes_full_batch(self):
+    """Test the BigQueryBatcher flushes once max_rows are buffered."""
+    self.mock_bigquery_client.insert_rows_json.return_value = []
+    batcher = classify_product_lib.BigQueryBatcher(
+        self.mock_bigquery_client, self.mock_table_id, max_rows=3
+    )
+    rows = [
+        {'image_link': f'http://image{i}.com', 'timestamp': '2025-03-11'}
+        for i in range(3)
+    ]
+
+    batcher.add(rows[:2])
+    self.mock_bigquery_client.insert_rows_json.assert_not_called()
+    batcher.add(rows[2:])
+
+    self.mock_bigquery_client.insert_rows_json.assert_called_once_with(
+        self.mock_table_id, rows, row_ids=mock.ANY
+    )
+    row_ids = self.mock_bigquery_client.insert_rows_json.call_args.kwargs[
+        'row_ids'
+    ]
+    self.assertEqual(len(set(row_ids)), 3)
+
+  def test_bigquery_batcher_flushes_old_batch(self):
+    """Test the BigQueryBatcher flushes once max_latency_seconds pass."""
+    self.mock_bigquery_client.insert_rows_json.return_value = []
+    batcher = classify_product_lib.BigQueryBatcher(
+        self.mock_bigquery_client, self.mock_table_id, max_latency_seconds=0
+    )
+    batcher.add([{'image_link': 'http://image1.com', 'timestamp': '2025'}])
+    self.mock_bigquery_client.insert_rows_json.assert_called_once()
+
+  def test_bigquery_batcher_raises_only_for_own_rejected_rows(self):
+    """Test flushing a caller's rows only raises for its rejected rows."""
+    batcher = classify_product_lib.BigQueryBatcher(
+        self.mock_bigquery_client, self.mock_table_id
+    )
+    rows = [
+        {'image_link': f'http://image{i}.com', 'timestamp': '2025-03-11'}
+        for i in range(3)
+    ]
+    row_error = {'index': 2, 'errors': [{'reason': 'invalid'}]}
+    self.mock_bigquery_client.insert_rows_json.return_value = [row_error]
+
+    other_rows = batcher.add(rows[:2])
+    own_rows = batcher.add(rows[2:])
+    with self.assertRaises(classify_product_lib.BigQueryWriteError) as cm:
+      batcher.flush([own_rows])
+    self.assertEqual(cm.exception.args, ([row_error],))
+
+    # The other caller's rows were written by the same request.
+    batcher.flush([other_rows])
+    self.mock_bigquery_client.insert_rows_json.assert_called_once()
+
+  def test_bigquery_batcher_drops_own_rows_on_failed_flush(self):
+    """Test a failed flush of a caller's rows keeps only the other rows."""
+    self.mock_bigquery_client.insert_rows_json.side_effect = [
+        Exception('BigQuery error'),
+        [],
+    ]
+    batcher = classify_product_lib.BigQueryBatcher(
+        self.mock_bigquery_client, self.mock_table_id
+    )
+    rows = [
+        {'image_link': f'http://image{i}.com', 'timestamp': '2025-03-11'}
+        for i in range(2)
+    ]
+    own_rows = batcher.add(rows[:1])
+    other_rows = batcher.add(rows[1:])
+
+    with self.assertRaises(classify_product_lib.BigQueryWriteError):
+      batcher.flush([own_rows])
+    # The caller retries its own rows, so they are not written again.
+    batcher.flush([other_rows])
+
+    self.mock_bigquery_client.insert_rows_json.assert_called_with(
+        self.mock_table_id, rows[1:], row_ids=mock.ANY
+    )
+
+  def test_bigquery_batcher_retries_failed_flush(self):
+    """Test the BigQueryBatcher keeps rows when a flush fails."""
+    self.mock_bigquery_client.insert_rows_json.side_effect = [
+        Exception('BigQuery error'),
+        [],
+    ]
+    batcher = classify_product_lib.BigQueryBatcher(
+        self.mock_bigquery_client, self.mock_table_id
+    )
+    rows = [{'image_link': 'http://image1.com', 'timestamp': '2025-03-11'}]
+    batcher.add(rows)
+
+    with self.assertRaises(classify_product_lib.BigQueryWriteError):
+      batcher.flush()
+    batcher.flush()
+    batcher.flush()
+
+    self.assertEqual(self.mock_bigquery_client.insert_rows_json.call_count, 2)
+    first_call, second_call = (
+        self.mock_bigquery_client.insert_rows_json.call_args_list
+    )
+    self.assertEqual(first_call, second_call)
+
+  @mock.patch(
+      'src.classify_product.classify_product_lib.ProductClassifier.delete_uploaded_files'
+  )
   @mock.patch(
       'src.classify_product.classify_product_lib.ProductClassifier.write_result_to_bigquery'
   )
@@ -287,6 +618,7 @@ class TestClassifyProductLib(unittest.TestCase):
       mock_process_image,
       mock_run_multimodal_query,
       mock_write_result_to_bigquery,
+      mock_delete_uploaded_files,
   ):
     """Test process_offer function."""
 
@@ -294,19 +626,148 @@ class TestClassifyProductLib(unittest.TestCase):
         mock.MagicMock(spec=classify_product_lib.ProcessedImage),
         mock.MagicMock(spec=classify_product_lib.ProcessedImage),
     ]
-    mock_process_image.side_effect = mock_processed_images
-    mock_run_multimodal_query.return_value = 'test_response'
+    # Images are processed concurrently, so map by link rather than call order.
+    processed_images_by_link = dict(
+        zip(['http://image1.com', 'http://image2.com'], mock_processed_images)
+    )
+    mock_process_image.side_effect = processed_images_by_link.get
+    mock_run_multimodal_query.return_value = mock.MagicMock(
+        text='test_response'
+    )
+    pending_rows = concurrent.futures.Future()
+    pending_rows.set_result(None)
+    mock_write_result_to_bigquery.return_value = pending_rows
+    # The main image repeated in the additional images is only pulled once.
+    self.product1.additional_image_links.append('http://image1.com')
 
     class_under_test = self.get_class_under_test()
     class_under_test.process_product(self.product1)
 
     mock_process_image.assert_has_calls(
-        [mock.call('http://image1.com'), mock.call('http://image2.com')]
+        [mock.call('http://image1.com'), mock.call('http://image2.com')],
+        any_order=True,
     )
+    self.assertEqual(mock_process_image.call_count, 2)
     mock_run_multimodal_query.assert_called_once_with(
         self.product1, mock_processed_images
     )
     mock_write_result_to_bigquery.assert_called_once_with(mock_processed_images)
+    mock_delete_uploaded_files.assert_called_once_with(mock_processed_images)
+
+  @mock.patch(
+      'src.classify_product.classify_product_lib.ProductClassifier.process_product_async'
+  )
+  def test_process_products(self, mock_process_product_async):
+    """Test process_products function attempts every product."""
+    product2 = Product(
+        offer_id='offer2',
+        merchant_id=1,
+        aggregator_id=101,
+        title='Offer 2',
+        product_type='Product A',
+        brand='Brand A',
+        image_link='http://image3.com',
+        additional_image_links=[],
+    )
+    pending_rows = concurrent.futures.Future()
+    pending_rows.set_result(None)
+    mock_process_product_async.side_effect = [
+        Exception('processing error'),
+        pending_rows,
+    ]
+
+    with self.assertRaisesRegex(
+        classify_product_lib.TooManyFailuresError, "1 of 2 .*'offer1'"
+    ):
+      self.product_classifier.process_products([self.product1, product2])
+
+    self.assertEqual(mock_process_product_async.call_count, 2)
+
+  @mock.patch('asyncio.sleep')
+  @mock.patch(
+      'src.classify_product.classify_product_lib.ProductClassifier.run_multimodal_query'
+  )
+  def test_run_multimodal_query_with_backoff(
+      self, mock_run_multimodal_query, mock_sleep
+  ):
+    """Test Gemini queries are retried on 429s & the limit is decreased."""
+    rate_limit_error = classify_product_lib.GenerativeAIError('429')
+    rate_limit_error.__cause__ = genai_errors.ClientError(
+        429, {'error': {'message': 'Resource exhausted'}}
+    )
+    mock_response = mock.MagicMock()
+    mock_response.usage_metadata.total_token_count = 100
+    mock_run_multimodal_query.side_effect = [rate_limit_error, mock_response]
+    rate_limiter = classify_product_lib.AdaptiveRateLimiter(max_concurrency=4)
+
+    response = asyncio.run(
+        self.product_classifier._run_multimodal_query_with_backoff(
+            self.product1, [self.processed_image1], rate_limiter
+        )
+    )
+
+    self.assertEqual(response, mock_response)
+    self.assertEqual(mock_run_multimodal_query.call_count, 2)
+    mock_sleep.assert_called_once()
+    # Halved to 2 after the 429, then increased by one after the success.
+    self.assertEqual(rate_limiter.concurrency_limit, 3)
+
+  @mock.patch(
+      'src.classify_product.classify_product_lib.ProductClassifier.run_multimodal_query'
+  )
+  def test_run_multimodal_query_with_backoff_releases_on_error(
+      self, mock_run_multimodal_query
+  ):
+    """Test the rate limiter is released once when the query raises."""
+    mock_run_multimodal_query.side_effect = ValueError('unexpected')
+    rate_limiter = mock.MagicMock(spec=classify_product_lib.AdaptiveRateLimiter)
+
+    with self.assertRaises(ValueError):
+      asyncio.run(
+          self.product_classifier._run_multimodal_query_with_backoff(
+              self.product1, [self.processed_image1], rate_limiter
+          )
+      )
+
+    rate_limiter.acquire.assert_awaited_once()
+    rate_limiter.release.assert_awaited_once_with(
+        tokens=0, rate_limited=False
+    )
+
+  @mock.patch(
+      'src.classify_product.classify_product_lib.ProductClassifier.run_multimodal_query'
+  )
+  def test_run_multimodal_query_with_backoff_all_images_labeled(
+      self, mock_run_multimodal_query
+  ):
+    """Test no Gemini quota is used when all images are already labeled."""
+    self.processed_image1.labeled_image = LabeledImage(type='silo')
+    rate_limiter = mock.MagicMock(spec=classify_product_lib.AdaptiveRateLimiter)
+
+    response = asyncio.run(
+        self.product_classifier._run_multimodal_query_with_backoff(
+            self.product1, [self.processed_image1], rate_limiter
+        )
+    )
+
+    self.assertIsNone(response)
+    rate_limiter.acquire.assert_not_called()
+    rate_limiter.release.assert_not_called()
+    mock_run_multimodal_query.assert_not_called()
+
+  def test_adaptive_rate_limiter_request_budget(self):
+    """Test the AdaptiveRateLimiter waits once the request budget is used."""
+    rate_limiter = classify_product_lib.AdaptiveRateLimiter(
+        max_concurrency=4, requests_per_minute=1
+    )
+
+    async def acquire_twice():
+      await rate_limiter.acquire()
+      await rate_limiter.release()
+      await asyncio.wait_for(rate_limiter.acquire(), timeout=0.1)
+
+    with self.assertRaises(asyncio.TimeoutError):
+      asyncio.run(acquire_twice())
 
   def test_product_classifier_initialization(self):
     """Test ProductClassifier initialization."""
@@ -333,3 +794,37 @@ class TestClassifyProductLib(unittest.TestCase):
     self.assertIsInstance(
         self.product_classifier.genai_config, types.GenerateContentConfig
     )
+
+  @mock.patch('google.genai.Client')
+  @mock.patch('google.cloud.bigquery.Client')
+  @mock.patch('requests.Session')
+  def test_product_classifier_uses_shared_clients(
+      self, mock_http_session_cls, mock_bigquery_client_cls, mock_genai_cls
+  ):
+    """Test ProductClassifier instances share lazily created clients."""
+    classify_product_lib._reset_shared_clients()
+    self.addCleanup(classify_product_lib._reset_shared_clients)
+
+    classifiers = [
+        classify_product_lib.ProductClassifier(
+            self.mock_prompt, self.mock_model_name, self.mock_table_id
+        )
+        for _ in range(2)
+    ]
+
+    self.assertIs(classifiers[0].http_session, classifiers[1].http_session)
+    self.assertIs(
+        classifiers[0].bigquery_client, classifiers[1].bigquery_client
+    )
+    self.assertIs(classifiers[0].genai_client, classifiers[1].genai_client)
+    mock_http_session_cls.assert_called_once()
+    mock_bigquery_client_cls.assert_called_once()
+    mock_genai_cls.assert_called_once()
+    http_session = mock_http_session_cls.return_value
+    http_session.mount.assert_has_calls(
+        [mock.call('http://', mock.ANY), mock.call('https://', mock.ANY)]
+    )
+    http_adapter = http_session.mount.call_args.args[1]
+    self.assertEqual(
+        http_adapter.max_retries.total, classify_product_lib.HTTP_RETRY.total
+    )
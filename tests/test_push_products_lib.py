@@ -14,17 +14,17 @@
 
 """Unit tests for the push_products_lib library."""
 
+import asyncio
+import dataclasses
+import json
 import logging
-import os
 import sys
 import unittest
 from unittest import mock
+from google.api_core import exceptions as api_exceptions
+from google.cloud import bigquery
 from google.cloud import tasks_v2
-
-# To avoid relative symlink issues, get the absolute path to 'src' directory
-src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
-if src_path not in sys.path:
-  sys.path.insert(0, src_path)
+import pyarrow
 
 try:
   from shared.common import Product  # pylint: disable=g-import-not-at-top
@@ -33,21 +33,61 @@ try:
 except ImportError as e:
   raise ImportError(
       'Failed to import modules. Check sys.path and structure. Current'
-      f' src_path: {src_path}. Error: {e}'
+      f' sys.path: {sys.path}. Error: {e}'
   ) from e
 
 
+# BigQuery rows of product1 and product2, as returned by the views.
+_MOCK_ROWS = (
+    {
+        'offer_id': 'offer1',
+        'merchant_id': 1,
+        'aggregator_id': 101,
+        'title': 'Offer 1',
+        'product_type': 'Product A',
+        'brand': 'Brand A',
+        'image_link': 'http://image1.com',
+        'additional_image_links': ['http://image2.com'],
+    },
+    {
+        'offer_id': 'offer2',
+        'merchant_id': 2,
+        'aggregator_id': 102,
+        'title': 'Offer 2',
+        'product_type': 'Product B',
+        'brand': 'Brand B',
+        'image_link': 'http://image3.com',
+        'additional_image_links': [],
+    },
+)
+
+
+def setUpModule():
+  # Suppress logging during tests unless needed for debugging
+  logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+  logging.disable(logging.NOTSET)  # Re-enable logging
+
+
 class TestProductPusher(unittest.TestCase):
   """Unit tests for the ProductPusher class."""
 
-  def setUp(self):
-    """Set up test environment."""
-    super().setUp()
-    self.mock_bigquery_client = mock.MagicMock()
-    self.mock_tasks_client = mock.MagicMock()
+  @classmethod
+  def setUpClass(cls):
+    """Set up the configuration and sample products shared by all tests."""
+    super().setUpClass()
+
+    cls.mock_project_id = 'test_project'
+    cls.mock_dataset_id = 'test_dataset'
+    cls.mock_location = 'test_location'
+    cls.mock_queue_id = 'test_queue'
+    cls.mock_cloud_function_url = 'http://test-function.com/classify'
+    cls.mock_queue_path = f'projects/{cls.mock_project_id}/locations/{cls.mock_location}/queues/{cls.mock_queue_id}'
 
-    # Sample product data for tests
-    self.product1 = Product(
+    # Sample product data for tests, shared since Products are frozen.
+    cls.product1 = Product(
         offer_id='offer1',
         merchant_id=1,
         aggregator_id=101,
@@ -57,7 +97,7 @@ class TestProductPusher(unittest.TestCase):
         image_link='http://image1.com',
         additional_image_links=['http://image2.com'],
     )
-    self.product2 = Product(
+    cls.product2 = Product(
         offer_id='offer2',
         merchant_id=2,
         aggregator_id=102,
@@ -67,7 +107,7 @@ class TestProductPusher(unittest.TestCase):
         image_link='http://image3.com',
         additional_image_links=[],
     )
-    self.product3 = Product(
+    cls.product3 = Product(
         offer_id='offer3',
         merchant_id=3,
         aggregator_id=103,
@@ -78,49 +118,76 @@ class TestProductPusher(unittest.TestCase):
         additional_image_links=[],
     )
 
-    # Configuration values
-    self.mock_project_id = 'test_project'
-    self.mock_dataset_id = 'test_dataset'
-    self.mock_location = 'test_location'
-    self.mock_queue_id = 'test_queue'
-    self.mock_cloud_function_url = 'http://test-function.com/classify'
-    self.mock_queue_path = f'projects/{self.mock_project_id}/locations/{self.mock_location}/queues/{self.mock_queue_id}'
+  def setUp(self):
+    """Set up test environment."""
+    super().setUp()
+    self.mock_bigquery_client = mock.MagicMock()
+    self.mock_tasks_client = mock.MagicMock()
+    self.mock_tasks_async_client = mock.MagicMock()
+    self.mock_tasks_async_client.create_task = mock.AsyncMock()
+    self.mock_tasks_async_client.transport.close = mock.AsyncMock()
 
-    # Patch the client constructors and assign mocks
-    self.bigquery_patcher = mock.patch(
-        'google.cloud.bigquery.Client',
-        autospec=True,
-        return_value=self.mock_bigquery_client,
-    )
-    self.tasks_patcher = mock.patch(
-        'google.cloud.tasks_v2.CloudTasksClient',
-        autospec=True,
-        return_value=self.mock_tasks_client,
-    )
+    # Ensure the mock tasks client returns the expected queue path
+    self.mock_tasks_client.queue_path.return_value = self.mock_queue_path
 
-    self.mock_bigquery_constructor = self.bigquery_patcher.start()
-    self.mock_tasks_constructor = self.tasks_patcher.start()
+    self.product_pusher = self.get_class_under_test()
 
-    # Instantiate the class under test AFTER patching
-    self.product_pusher = push_products_lib.ProductPusher(
+  def get_class_under_test(self):
+    return push_products_lib.ProductPusher(
         project_id=self.mock_project_id,
         dataset_id=self.mock_dataset_id,
         location=self.mock_location,
         queue_id=self.mock_queue_id,
+        bigquery_client=self.mock_bigquery_client,
+        tasks_client=self.mock_tasks_client,
+        tasks_async_client_factory=lambda: self.mock_tasks_async_client,
     )
 
-    # Ensure the mock tasks client returns the expected queue path
-    self.mock_tasks_client.queue_path.return_value = self.mock_queue_path
+  def assert_queue_path_resolved_once(self):
+    """Asserts the queue path was resolved once, when the pusher was created."""
+    self.mock_tasks_client.queue_path.assert_called_once_with(
+        self.mock_project_id, self.mock_location, self.mock_queue_id
+    )
+
+  # --- Tests for Product ---
+
+  def test_product_hash(self):
+    """Test Products hash by IDs & are deduplicated in sets when equal."""
+    product1_copy = dataclasses.replace(self.product1)
+    product1_renamed = dataclasses.replace(self.product1, title='Renamed')
+
+    self.assertEqual(hash(product1_copy), hash(self.product1))
+    self.assertEqual(hash(product1_renamed), hash(self.product1))
+    self.assertEqual(
+        {self.product1, product1_copy, self.product2},
+        {self.product1, self.product2},
+    )
+    self.assertEqual(len({self.product1, product1_copy}), 1)
+    # Equality compares every field, so a changed product is kept.
+    self.assertEqual(len({self.product1, product1_renamed}), 2)
+
+  def test_product_to_dict_copies_image_links(self):
+    """Test changes to the to_dict result don't alter the Product."""
+    product_dict = self.product1.to_dict()
+    product_dict['additional_image_links'].append('http://image5.com')
+
+    self.assertEqual(
+        self.product1.additional_image_links, ['http://image2.com']
+    )
+
+  def test_product_to_json_bytes(self):
+    """Test a Product serializes to the JSON of its dictionary."""
+    self.assertEqual(
+        json.loads(self.product1.to_json_bytes()), self.product1.to_dict()
+    )
 
-    # Suppress logging during tests unless needed for debugging
-    logging.disable(logging.CRITICAL)
+  def test_product_filter_is_frozen(self):
+    """Test a ProductFilter can't be changed after its SQL filter is built."""
+    product_filter = ProductFilter(brands=[' Brand A '])
 
-  def tearDown(self):
-    """Clean up after tests."""
-    self.bigquery_patcher.stop()
-    self.tasks_patcher.stop()
-    logging.disable(logging.NOTSET)  # Re-enable logging
-    super().tearDown()
+    self.assertEqual(product_filter.brands, ['brand a'])
+    with self.assertRaises(dataclasses.FrozenInstanceError):
+      product_filter.brands = ['Brand B']
 
   # --- Tests for is_queue_empty ---
 
@@ -130,9 +197,7 @@ class TestProductPusher(unittest.TestCase):
     self.mock_tasks_client.list_tasks.return_value.tasks = iter([])
 
     self.assertTrue(self.product_pusher.is_queue_empty())
-    self.mock_tasks_client.queue_path.assert_called_once_with(
-        self.mock_project_id, self.mock_location, self.mock_queue_id
-    )
+    self.assert_queue_path_resolved_once()
     expected_request = tasks_v2.ListTasksRequest(
         parent=self.mock_queue_path, page_size=1
     )
@@ -148,9 +213,7 @@ class TestProductPusher(unittest.TestCase):
     )
 
     self.assertFalse(self.product_pusher.is_queue_empty())
-    self.mock_tasks_client.queue_path.assert_called_once_with(
-        self.mock_project_id, self.mock_location, self.mock_queue_id
-    )
+    self.assert_queue_path_resolved_once()
     expected_request = tasks_v2.ListTasksRequest(
         parent=self.mock_queue_path, page_size=1
     )
@@ -166,9 +229,7 @@ class TestProductPusher(unittest.TestCase):
         push_products_lib.CloudTasksPublishError, 'Error checking queue status'
     ):
       self.product_pusher.is_queue_empty()
-    self.mock_tasks_client.queue_path.assert_called_once_with(
-        self.mock_project_id, self.mock_location, self.mock_queue_id
-    )
+    self.assert_queue_path_resolved_once()
     expected_request = tasks_v2.ListTasksRequest(
         parent=self.mock_queue_path, page_size=1
     )
@@ -176,138 +237,125 @@ class TestProductPusher(unittest.TestCase):
         request=expected_request
     )
 
-  # --- Tests for get_new_products_from_view ---
-
-  def test_get_new_products_from_view_success(self):
-    """Test get_new_products_from_view function with successful BigQuery read."""
-    mock_rows = [
-        {
-            'offer_id': 'offer1',
-            'merchant_id': 1,
-            'aggregator_id': 101,
-            'title': 'Offer 1',
-            'product_type': 'Product A',
-            'brand': 'Brand A',
-            'image_link': 'http://image1.com',
-            'additional_image_links': ['http://image2.com'],
-        },
-        {
-            'offer_id': 'offer2',
-            'merchant_id': 2,
-            'aggregator_id': 102,
-            'title': 'Offer 2',
-            'product_type': 'Product B',
-            'brand': 'Brand B',
-            'image_link': 'http://image3.com',
-            'additional_image_links': [],
-        },
+  # --- Tests for get_new_products_from_view & get_all_products_from_view ---
+
+  def test_get_products_from_view_success(self):
+    """Test get_*_products_from_view with successful BigQuery reads."""
+    test_cases = [
+        (
+            'get_new_products_from_view',
+            'get_new_products_view',
+            ProductFilter(brands=['Brand A']),
+            'LOWER(brand) IN UNNEST(@brands)',
+            bigquery.ArrayQueryParameter('brands', 'STRING', ['brand a']),
+        ),
+        (
+            'get_all_products_from_view',
+            'get_all_products_view',
+            ProductFilter(product_type='Product A'),
+            'LOWER(product_type) LIKE @product_type_prefix',
+            bigquery.ScalarQueryParameter(
+                'product_type_prefix', 'STRING', 'product a%'
+            ),
+        ),
     ]
-    # Mock the query result
+    for (
+        method_name,
+        view_name,
+        product_filter,
+        sql_filter,
+        filter_parameter,
+    ) in test_cases:
+      with self.subTest(method_name=method_name):
+        self.mock_bigquery_client.reset_mock()
+        # Mock the query result
+        mock_query_job = mock.MagicMock()
+        mock_query_job.result.return_value = list(_MOCK_ROWS)
+        self.mock_bigquery_client.query.return_value = mock_query_job
+
+        products = getattr(self.product_pusher, method_name)(
+            product_limit=2, product_filter=product_filter
+        )
+
+        # Assertions
+        self.assertEqual(products, [self.product1, self.product2])
+
+        # Check BigQuery query call
+        self.mock_bigquery_client.query.assert_called_once()
+        call_args, _ = self.mock_bigquery_client.query.call_args
+        query = call_args[0]
+        self.assertIn(
+            f'FROM `{self.mock_project_id}.{self.mock_dataset_id}.{view_name}`',
+            query,
+        )
+        self.assertIn('LIMIT @product_limit', query)
+        job_config = self.mock_bigquery_client.query.call_args.kwargs[
+            'job_config'
+        ]
+        self.assertEqual(
+            job_config.query_parameters,
+            [
+                bigquery.ScalarQueryParameter('product_limit', 'INT64', 2),
+                filter_parameter,
+            ],
+        )
+        self.assertIn(f'WHERE {sql_filter}', query)
+
+  @mock.patch('google.cloud.bigquery_storage.BigQueryReadClient', autospec=True)
+  def test_get_products_from_view_storage_api(self, mock_bqstorage_client_cls):
+    """Test get_*_products_from_view stream large results as Arrow."""
+    for method_name in (
+        'get_new_products_from_view',
+        'get_all_products_from_view',
+    ):
+      with self.subTest(method_name=method_name):
+        self.mock_bigquery_client.reset_mock()
+        mock_query_job = mock.MagicMock()
+        mock_rows = mock_query_job.result.return_value
+        mock_rows.to_arrow_iterable.return_value = [
+            pyarrow.RecordBatch.from_pylist([self.product1.to_dict()]),
+            pyarrow.RecordBatch.from_pylist([self.product2.to_dict()]),
+        ]
+        self.mock_bigquery_client.query.return_value = mock_query_job
+
+        products = getattr(self.product_pusher, method_name)(
+            product_limit=push_products_lib.STORAGE_API_MIN_ROWS + 1
+        )
+
+        self.assertEqual(products, [self.product1, self.product2])
+        mock_rows.to_arrow_iterable.assert_called_once_with(
+            bqstorage_client=mock_bqstorage_client_cls.return_value
+        )
+    # The Storage Read API client is reused across reads.
+    mock_bqstorage_client_cls.assert_called_once_with()
+
+  def test_iter_new_products_from_view_is_lazy(self):
+    """Test iter_new_products_from_view only queries once iterated."""
     mock_query_job = mock.MagicMock()
-    mock_query_job.result.return_value = mock_rows
+    mock_query_job.result.return_value = [self.product1.to_dict()]
     self.mock_bigquery_client.query.return_value = mock_query_job
 
-    # Mock ProductFilter
-    mock_product_filter = mock.MagicMock(spec=ProductFilter)
-    mock_product_filter.get_sql_filter.return_value = (
-        'LOWER(brand) IN ("brand a")'
-    )
-
-    products = self.product_pusher.get_new_products_from_view(
-        product_limit=2, product_filter=mock_product_filter
-    )
-
-    # Assertions
-    self.assertEqual(len(products), 2)
-    self.assertEqual(products[0], self.product1)
-    self.assertEqual(products[1], self.product2)
+    products = self.product_pusher.iter_new_products_from_view()
+    self.mock_bigquery_client.query.assert_not_called()
 
-    # Check BigQuery query call
+    self.assertEqual(next(products), self.product1)
     self.mock_bigquery_client.query.assert_called_once()
-    call_args, _ = self.mock_bigquery_client.query.call_args
-    query = call_args[0]
-    self.assertIn(
-        'FROM'
-        f' `{self.mock_project_id}.{self.mock_dataset_id}.get_new_products_view`',
-        query,
-    )
-    self.assertIn('LIMIT 2', query)
-    self.assertIn('WHERE LOWER(brand) IN ("brand a")', query)
-    mock_product_filter.get_sql_filter.assert_called_once()
 
-  def test_get_new_products_bigquery_error(self):
-    """Test get_new_products_from_view with BigQuery read error."""
+  def test_get_products_from_view_bigquery_error(self):
+    """Test get_*_products_from_view with BigQuery read errors."""
     self.mock_bigquery_client.query.side_effect = Exception(
         'BigQuery connection failed'
     )
-    with self.assertRaisesRegex(
-        push_products_lib.BigQueryReadError, 'Failed to read from BigQuery view'
-    ):
-      self.product_pusher.get_new_products_from_view(product_limit=5)
-
-  # --- Tests for get_all_products_from_view (similar to get_new_products) ---
-
-  def test_get_all_products_from_view_success(self):
-    """Test get_all_products_from_view with successful BigQuery read."""
-    mock_rows = [
-        {
-            'offer_id': 'offer1',
-            'merchant_id': 1,
-            'aggregator_id': 101,
-            'title': 'Offer 1',
-            'product_type': 'Product A',
-            'brand': 'Brand A',
-            'image_link': 'http://image1.com',
-            'additional_image_links': ['http://image2.com'],
-        },
-        {
-            'offer_id': 'offer2',
-            'merchant_id': 2,
-            'aggregator_id': 102,
-            'title': 'Offer 2',
-            'product_type': 'Product B',
-            'brand': 'Brand B',
-            'image_link': 'http://image3.com',
-            'additional_image_links': [],
-        },
-    ]
-    # Mock the query result
-    mock_query_job = mock.MagicMock()
-    mock_query_job.result.return_value = mock_rows
-    self.mock_bigquery_client.query.return_value = mock_query_job
-
-    mock_product_filter = mock.MagicMock(spec=ProductFilter)
-    mock_product_filter.get_sql_filter.return_value = (
-        'LOWER(product_type) LIKE "product a%"'
-    )
-
-    products = self.product_pusher.get_all_products_from_view(
-        product_limit=5, product_filter=mock_product_filter
-    )
-
-    self.assertEqual(len(products), 2)
-    self.assertEqual(products[0], self.product1)
-    self.assertEqual(products[1], self.product2)
-
-    self.mock_bigquery_client.query.assert_called_once()
-    call_args, _ = self.mock_bigquery_client.query.call_args
-    query = call_args[0]
-    self.assertIn(
-        'FROM'
-        f' `{self.mock_project_id}.{self.mock_dataset_id}.get_all_products_view`',
-        query,
-    )
-    self.assertIn('LIMIT 5', query)
-    self.assertIn('WHERE LOWER(product_type) LIKE "product a%"', query)
-    mock_product_filter.get_sql_filter.assert_called_once()
-
-  def test_get_all_products_bigquery_error(self):
-    """Test get_all_products_from_view with BigQuery read error."""
-    self.mock_bigquery_client.query.side_effect = Exception('BigQuery died')
-    with self.assertRaisesRegex(
-        push_products_lib.BigQueryReadError, 'Failed to read from BigQuery view'
+    for method_name in (
+        'get_new_products_from_view',
+        'get_all_products_from_view',
     ):
-      self.product_pusher.get_all_products_from_view(product_limit=1)
+      with self.subTest(method_name=method_name):
+        with self.assertRaisesRegex(
+            push_products_lib.BigQueryReadError,
+            'Failed to read from BigQuery view',
+        ):
+          getattr(self.product_pusher, method_name)(product_limit=5)
 
   # --- Tests for push_products ---
 
@@ -325,29 +373,43 @@ class TestProductPusher(unittest.TestCase):
     # Assertions
     self.assertEqual(success_count, expected_task_count)
     self.assertEqual(failure_count, 0)
-    self.mock_tasks_client.queue_path.assert_called_once_with(
-        self.mock_project_id, self.mock_location, self.mock_queue_id
-    )
+    self.assert_queue_path_resolved_once()
     self.assertEqual(
-        self.mock_tasks_client.create_task.call_count, expected_task_count
-    )
-
-    # Verify the details of each task created (optional but good)
-    calls = self.mock_tasks_client.create_task.call_args_list
-    for i, product in enumerate(products_to_push):
-      request_arg = calls[i].kwargs[
-          'request'
-      ]  # Access by keyword arg 'request'
-      self.assertEqual(request_arg.parent, self.mock_queue_path)
-      task = request_arg.task
-      self.assertEqual(task.http_request.url, self.mock_cloud_function_url)
-      self.assertEqual(task.http_request.http_method, tasks_v2.HttpMethod.POST)
-      self.assertEqual(
-          task.http_request.body, product.to_json().encode('utf-8')
-      )
-      self.assertEqual(
-          task.http_request.headers['Content-type'], 'application/json'
-      )
+        self.mock_tasks_async_client.create_task.call_count, expected_task_count
+    )
+
+    # Verify the details of each task created. Tasks are created concurrently,
+    # so the calls may be in any order.
+    expected_calls = [
+        mock.call(
+            request=tasks_v2.CreateTaskRequest(
+                parent=self.mock_queue_path,
+                task=tasks_v2.Task(
+                    http_request=tasks_v2.HttpRequest(
+                        url=self.mock_cloud_function_url,
+                        http_method=tasks_v2.HttpMethod.POST,
+                        headers={'Content-type': 'application/json'},
+                        body=product.to_json().encode('utf-8'),
+                    )
+                ),
+            ),
+            retry=push_products_lib.CREATE_TASK_RETRY,
+        )
+        for product in products_to_push
+    ]
+    self.mock_tasks_async_client.create_task.assert_has_calls(
+        expected_calls, any_order=True
+    )
+
+  def test_create_task_retry_predicate(self):
+    """Test task creation is only retried when the service is unavailable."""
+    predicate = push_products_lib.CREATE_TASK_RETRY._predicate  # pylint: disable=protected-access
+
+    self.assertTrue(predicate(api_exceptions.ServiceUnavailable('Unavailable')))
+    # The task may have been created before the deadline, so no retry.
+    self.assertFalse(predicate(api_exceptions.DeadlineExceeded('Deadline')))
+    self.assertFalse(predicate(api_exceptions.InvalidArgument('Invalid')))
+    self.assertFalse(predicate(Exception('Other error')))
 
   def test_push_products_partial_failure(self):
     """Test push_products when some tasks fail to create."""
@@ -355,17 +417,14 @@ class TestProductPusher(unittest.TestCase):
     expected_success = 2
     expected_failures = 1
 
-    # Simulate failure for the second product (index 1)
-    mock_task_result_ok = mock.MagicMock()  # Simulate successful task creation
-    mock_task_result_fail = Exception(
-        'Simulated task creation failure for offer2'
-    )
+    # Simulate failure for the second product. Tasks are created concurrently,
+    # so the failure is matched on the task body rather than the call order.
+    def create_task(request, retry):  # pylint: disable=unused-argument
+      if request.task.http_request.body == self.product2.to_json().encode():
+        raise Exception('Simulated task creation failure for offer2')
+      return mock.MagicMock()  # Simulate successful task creation
 
-    self.mock_tasks_client.create_task.side_effect = [
-        mock_task_result_ok,  # Success for product1
-        mock_task_result_fail,  # Failure for product2
-        mock_task_result_ok,  # Success for product3
-    ]
+    self.mock_tasks_async_client.create_task.side_effect = create_task
 
     # Patch logging to check error messages
     with mock.patch(
@@ -380,22 +439,15 @@ class TestProductPusher(unittest.TestCase):
     # Assertions
     self.assertEqual(success_count, expected_success)
     self.assertEqual(failure_count, expected_failures)
-    self.mock_tasks_client.queue_path.assert_called_once_with(
-        self.mock_project_id, self.mock_location, self.mock_queue_id
-    )
+    self.assert_queue_path_resolved_once()
     # create_task should be called for all products, even if some fail
     self.assertEqual(
-        self.mock_tasks_client.create_task.call_count, len(products_to_push)
+        self.mock_tasks_async_client.create_task.call_count,
+        len(products_to_push),
     )
 
-    # Check that error was logged for the failed task
-    mock_logging.error.assert_called_once()
-    args, kwargs = mock_logging.error.call_args
-    self.assertIn(
-        f'Failed to create task for product ID {self.product2.offer_id}',
-        args[0],
-    )
-    self.assertTrue(kwargs.get('exc_info'))  # Check if stack trace was included
+    # Failures are only logged in the summary, without tracebacks by default
+    mock_logging.error.assert_not_called()
 
     # Check summary logs
     self.assertIn(
@@ -408,23 +460,120 @@ class TestProductPusher(unittest.TestCase):
     )
     self.assertIn(
         mock.call(
-            '%d products failed to queue. See previous error logs for details.',
+            '%d products failed to queue.',
             expected_failures,
             extra={
                 'json_fields': {
                     'failed_offer_ids': [
                         self.product2.offer_id,
-                    ]
+                    ],
+                    'failures': [{
+                        'offer_id': self.product2.offer_id,
+                        'error': repr(
+                            Exception(
+                                'Simulated task creation failure for offer2'
+                            )
+                        ),
+                    }],
                 }
             },
         ),
         mock_logging.warning.call_args_list,
     )
 
-  def test_push_products_queue_path_error(self):
-    """Test push_products when getting the queue path fails."""
-    products_to_push = [self.product1, self.product2]
+  def test_push_products_failure_with_tracebacks(self):
+    """Test push_products logs failure tracebacks when log_tracebacks is set."""
+    self.mock_tasks_async_client.create_task.side_effect = Exception(
+        'Simulated task creation failure'
+    )
+
+    with mock.patch(
+        'src.push_products.push_products_lib.logging'
+    ) as mock_logging:
+      success_count, failure_count = self.product_pusher.push_products(
+          products=[self.product1],
+          cloud_function_url=self.mock_cloud_function_url,
+          log_tracebacks=True,
+      )
+
+    self.assertEqual((success_count, failure_count), (0, 1))
+    mock_logging.warning.assert_called_once()
+    failures = mock_logging.warning.call_args.kwargs['extra']['json_fields'][
+        'failures'
+    ]
+    self.assertEqual(len(failures), 1)
+    self.assertEqual(failures[0]['offer_id'], self.product1.offer_id)
+    self.assertEqual(
+        failures[0]['error'],
+        repr(Exception('Simulated task creation failure')),
+    )
+    self.assertIn('Traceback (most recent call last)', failures[0]['traceback'])
+    self.assertIn(
+        'Exception: Simulated task creation failure', failures[0]['traceback']
+    )
+
+  def test_push_products_batched(self):
+    """Test push_products sends batches of products per task."""
+    products_to_push = [self.product1, self.product2, self.product3]
+
+    success_count, failure_count = self.product_pusher.push_products(
+        products=products_to_push,
+        cloud_function_url=self.mock_cloud_function_url,
+        batch_size=2,
+    )
+
+    self.assertEqual(success_count, 3)
+    self.assertEqual(failure_count, 0)
+    bodies = [
+        json.loads(c.kwargs['request'].task.http_request.body)
+        for c in self.mock_tasks_async_client.create_task.call_args_list
+    ]
+    self.assertCountEqual(
+        bodies,
+        [
+            [self.product1.to_dict(), self.product2.to_dict()],
+            self.product3.to_dict(),
+        ],
+    )
+
+  def test_push_products_invalid_batch_size(self):
+    """Test push_products rejects batch sizes below 1."""
+    for batch_size in (0, -1):
+      with self.subTest(batch_size=batch_size):
+        with self.assertRaisesRegex(
+            ValueError, 'batch_size must be at least 1'
+        ):
+          self.product_pusher.push_products(
+              products=[self.product1],
+              cloud_function_url=self.mock_cloud_function_url,
+              batch_size=batch_size,
+          )
+    self.mock_tasks_async_client.create_task.assert_not_called()
+
+  def test_push_products_from_iterator(self):
+    """Test push_products consumes an iterator of products."""
+    success_count, failure_count = self.product_pusher.push_products(
+        products=iter([self.product1, self.product2]),
+        cloud_function_url=self.mock_cloud_function_url,
+    )
+
+    self.assertEqual((success_count, failure_count), (2, 0))
+    self.assertEqual(self.mock_tasks_async_client.create_task.call_count, 2)
 
+  def test_push_products_in_running_event_loop(self):
+    """Test push_products when called with an event loop running."""
+
+    async def push_products_from_coroutine():
+      return self.product_pusher.push_products(
+          products=[self.product1],
+          cloud_function_url=self.mock_cloud_function_url,
+      )
+
+    self.assertEqual(asyncio.run(push_products_from_coroutine()), (1, 0))
+    self.mock_tasks_async_client.transport.close.assert_awaited_once()
+
+  def test_init_queue_path_error(self):
+    """Test ProductPusher initialization when getting the queue path fails."""
     # Simulate error when calling queue_path
     self.mock_tasks_client.queue_path.side_effect = Exception(
         'Cannot resolve queue path'
@@ -434,17 +583,34 @@ class TestProductPusher(unittest.TestCase):
     with self.assertRaisesRegex(
         push_products_lib.CloudTasksPublishError, 'Failed to resolve queue path'
     ):
-      self.product_pusher.push_products(
-          products=products_to_push,
-          cloud_function_url=self.mock_cloud_function_url,
-      )
+      self.get_class_under_test()
+
+  @mock.patch('google.cloud.tasks_v2.CloudTasksClient')
+  @mock.patch('google.cloud.bigquery.Client')
+  def test_init_default_clients(
+      self, mock_bigquery_client_cls, mock_tasks_client_cls
+  ):
+    """Test ProductPusher creates its own clients when none are passed."""
+    product_pusher = push_products_lib.ProductPusher(
+        project_id=self.mock_project_id,
+        dataset_id=self.mock_dataset_id,
+        location=self.mock_location,
+        queue_id=self.mock_queue_id,
+    )
 
-    # Assert queue_path was called
-    self.mock_tasks_client.queue_path.assert_called_once_with(
-        self.mock_project_id, self.mock_location, self.mock_queue_id
+    mock_bigquery_client_cls.assert_called_once_with(self.mock_project_id)
+    self.assertIs(
+        product_pusher.bigquery_client, mock_bigquery_client_cls.return_value
+    )
+    self.assertIs(
+        product_pusher.tasks_client, mock_tasks_client_cls.return_value
+    )
+    self.assertIs(
+        product_pusher.tasks_async_client_factory,
+        tasks_v2.CloudTasksAsyncClient,
     )
-    # Assert create_task was NOT called
-    self.mock_tasks_client.create_task.assert_not_called()
+    # The Storage Read API client is only created for the first large read.
+    self.assertIsNone(product_pusher.bigquery_storage_client)
 
 
 if __name__ == '__main__':